@@ -0,0 +1,56 @@
+import time
+import asyncio
+import logging
+from telegram.constants import ChatMemberStatus
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+
+class AdminCache:
+    """
+    Caches the administrator set of each chat for `ttl` seconds, so permission
+    checks are an in-memory lookup instead of a `get_chat_member` round-trip.
+    The set is bulk-fetched with `get_chat_administrators` and dropped as soon
+    as a ChatMemberUpdated event changes someone's admin status.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._admins = {}
+        self._locks = {}
+
+    async def get(self, bot, chat_id):
+        """Returns the set of admin user ids for `chat_id`, fetching it if stale."""
+        cached = self._admins.get(chat_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        # Concurrent misses for the same chat share a single fetch.
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            cached = self._admins.get(chat_id)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            members = await bot.get_chat_administrators(chat_id)
+            admins = frozenset(m.user.id for m in members if m.status in ADMIN_STATUSES)
+            self._admins[chat_id] = (time.monotonic() + self.ttl, admins)
+            return admins
+
+    async def is_admin(self, bot, chat_id, user_id):
+        return user_id in await self.get(bot, chat_id)
+
+    def invalidate(self, chat_id=None):
+        if chat_id is None:
+            self._admins.clear()
+        else:
+            self._admins.pop(chat_id, None)
+
+    def on_member_updated(self, chat_member_updated):
+        """Drops the cached set if the update promotes or demotes an admin."""
+        old = chat_member_updated.old_chat_member.status
+        new = chat_member_updated.new_chat_member.status
+        if (old in ADMIN_STATUSES) != (new in ADMIN_STATUSES):
+            logger.info(f"Admin set of chat {chat_member_updated.chat.id} changed, invalidating cache.")
+            self.invalidate(chat_member_updated.chat.id)
@@ -0,0 +1,221 @@
+"""
+Benchmarks the bot's handlers against synthetic ledgers, without Telegram.
+
+Drives the handlers in bot.py (`add_amount_command`, `balance_command`,
+`all_balances_command`), the payday logic and the settlement planner with fake Update/Bot objects,
+sweeping ledger sizes and concurrency levels, and reports throughput, p50/p99/max
+latency and peak memory per scenario:
+
+    python benchmark.py --sizes 10 1000 100000 1000000 --concurrency 1 10 100
+    python benchmark.py --storage sqlite --ops 500 --trace-memory
+
+Every ledger size runs in its own temporary directory, so the real ledger
+files are never touched.
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+# config.py reads the environment on import
+os.environ.setdefault("TELEGRAM_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_ID", "-1000000000001")
+os.environ.setdefault("DEFAULT_IMPORT_AMOUNT", "3.50")
+os.environ.setdefault("PAYDAY_DAY", "1")
+
+ADMIN_ID = 1
+
+
+# --- Fakes ---
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = 0
+
+    async def reply_text(self, text, **kwargs):
+        self.replies += 1
+
+
+class FakeBot:
+    async def get_chat_administrators(self, chat_id):
+        admin = types.SimpleNamespace(id=ADMIN_ID)
+        return [types.SimpleNamespace(user=admin, status="administrator")]
+
+    async def send_message(self, **kwargs):
+        pass
+
+
+def fake_update(chat_id, text):
+    return types.SimpleNamespace(
+        message=FakeMessage(text),
+        effective_user=types.SimpleNamespace(id=ADMIN_ID),
+        effective_chat=types.SimpleNamespace(id=chat_id, type="supergroup"),
+    )
+
+
+def fake_context(bot, args):
+    return types.SimpleNamespace(args=args, bot=bot, bot_data={})
+
+
+# --- Scenarios ---
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_scenario(handler, make_args, ops, concurrency, chat_id, bot):
+    """Calls `handler` `ops` times with at most `concurrency` calls in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        args = make_args(i)
+        async with semaphore:
+            start = time.perf_counter()
+            await handler(fake_update(chat_id, " ".join(["/cmd"] + args)), fake_context(bot, args))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(ops)))
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput": ops / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def seed_ledger(size):
+    names = [f"user{i}" for i in range(size)]
+    balances = {name: round(random.uniform(-50, 50), 2) for name in names}
+    if config.STORAGE == "sqlite":
+        backend = config.open_backend()
+        backend.open(config.GROUP_ID).import_balances(balances)
+        backend.close()
+    else:
+        with open(config.BALANCES_FILE, "w") as f:
+            json.dump(balances, f)
+    return names
+
+
+def reset_state(bot):
+    """Gives bot.py fresh registries rooted in the current directory."""
+    from ledgers import LedgerRegistry
+    from outbox import Outbox
+    from scheduler import PaydayScheduler
+
+    bot.ledgers = LedgerRegistry(config.open_backend(), bot.ledgers.defaults, settings_path=config.GROUPS_FILE)
+    bot.scheduler = PaydayScheduler(config.SCHEDULE_FILE, hour=config.PAYDAY_HOUR)
+    bot.outbox = Outbox(config.OUTBOX_FILE)
+
+
+async def bench_size(bot, size, concurrency_levels, ops, trace_memory):
+    results = []
+    fake_bot = FakeBot()
+    chat_id = config.GROUP_ID
+
+    if trace_memory:
+        tracemalloc.start()
+    names = seed_ledger(size)
+    reset_state(bot)
+
+    start = time.perf_counter()
+    ledger = bot.ledgers.get(chat_id)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    for concurrency in concurrency_levels:
+        scenarios = {
+            "add_amount": (bot.add_amount_command, lambda i: [random.choice(names), "1.25"]),
+            "balance": (bot.balance_command, lambda i: [random.choice(names)]),
+            # The mutation before it means the first call pays for a full render (see max_ms)
+            "all_balances": (bot.all_balances_command, lambda i: ["desc"]),
+        }
+        for name, (handler, make_args) in scenarios.items():
+            if name == "all_balances":
+                ledger.store.adjust(names[0], 0.01)
+            stats = await run_scenario(handler, make_args, ops, concurrency, chat_id, fake_bot)
+            results.append({"size": size, "concurrency": concurrency, "scenario": name, **stats})
+
+    start = time.perf_counter()
+    transfers, _ = bot.plan_transfers(ledger.store.items())
+    settle_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    bot.apply_payday(ledger, {"name": "subscription", "amount": 3.5, "day": 1}, "2000-01")
+    payday_ms = (time.perf_counter() - start) * 1000
+
+    await bot.ledgers.close()
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    else:
+        # ru_maxrss is KiB on Linux; it only ever grows, so it is the peak of the run so far
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    results.append({"size": size, "concurrency": "-", "scenario": "load", "p50_ms": load_ms, "p99_ms": load_ms, "max_ms": load_ms})
+    results.append({"size": size, "concurrency": "-", "scenario": "payday", "p50_ms": payday_ms, "p99_ms": payday_ms, "max_ms": payday_ms})
+    results.append({"size": size, "concurrency": "-", "scenario": "settle", "p50_ms": settle_ms, "p99_ms": settle_ms, "max_ms": settle_ms, "transfers": len(transfers)})
+    return results, peak_mb
+
+
+def print_table(rows, peaks):
+    print(f"{'size':>9} {'conc':>5} {'scenario':<13} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for row in rows:
+        throughput = f"{row['throughput']:.0f}" if "throughput" in row else "-"
+        print(
+            f"{row['size']:>9} {row['concurrency']:>5} {row['scenario']:<13} "
+            f"{throughput:>10} {row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['max_ms']:>9.3f}"
+        )
+    print()
+    for size, peak in peaks.items():
+        print(f"peak memory with {size} users: {peak:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's handlers on synthetic ledgers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100_000, 1_000_000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--ops", type=int, default=1000, help="calls per scenario")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--trace-memory", action="store_true", help="measure peak Python heap per size (slower)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    os.environ["STORAGE"] = args.storage
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # Imported only now, as config.py reads STORAGE from the environment on import
+    global config
+    import config
+    import bot
+
+    random.seed(0)
+    rows = []
+    peaks = {}
+    cwd = os.getcwd()
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                results, peaks[size] = asyncio.run(bench_size(bot, size, args.concurrency, args.ops, args.trace_memory))
+                rows.extend(results)
+            finally:
+                os.chdir(cwd)
+
+    if args.json:
+        print(json.dumps({"storage": args.storage, "results": rows, "peak_mb": peaks}, indent=2))
+    else:
+        print_table(rows, peaks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1169 @@
+import os
+import math
+import time
+import signal
+import logging
+import functools
+import asyncio
+import datetime
+import tempfile
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
+from telegram.constants import ChatType
+from telegram.ext import (
+    Application,
+    CallbackQueryHandler,
+    ChatMemberHandler,
+    CommandHandler,
+    ContextTypes,
+    InlineQueryHandler,
+    MessageHandler,
+    filters,
+)
+from ledgers import LedgerRegistry
+from leader import LeaderLease
+from outbox import Outbox, TokenBucketRateLimiter
+from metrics import metrics, serve_metrics
+from scheduler import DEFAULT_CHARGE, PaydayScheduler, charges_of, get_timezone, is_valid_timezone
+from config import (
+    BOT_MODE,
+    CURRENCY,
+    DEFAULT_IMPORT_AMOUNT,
+    ERRORS,
+    GROUP_ID,
+    GROUPS_FILE,
+    LEADER_ELECTION,
+    LEADER_FILE,
+    METRICS_PORT,
+    OUTBOX_FILE,
+    PAYDAY_DAY,
+    PAYDAY_HOUR,
+    RATES_FILE,
+    SCHEDULE_FILE,
+    TIMEZONE,
+    TOKEN,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    open_backend,
+)
+from admins import AdminCache
+from reports import CALLBACK_PREFIX, FILTERS, SORTS, chunk_lines, parse_view
+from history import OP_LABELS, write_statement
+from settle import plan_transfers, transfer_changes
+from rates import RateTable
+from store import MAX_AMOUNT, StorageError, from_cents, to_cents
+from panels import PANEL_PREFIX, amounts_keyboard, find_name, parse_callback, users_keyboard
+
+logger = logging.getLogger(__name__)
+
+# Exchange rates from a local file, reloaded when the file is replaced
+rates = RateTable(RATES_FILE)
+
+# One ledger per group, opened on first use. GROUP_ID uses the settings from the
+# environment; other groups can override them with /setup.
+ledgers = LedgerRegistry(
+    open_backend(),
+    {"currency": CURRENCY, "import_amount": DEFAULT_IMPORT_AMOUNT, "payday_day": PAYDAY_DAY, "timezone": TIMEZONE},
+    settings_path=GROUPS_FILE,
+    rates=rates,
+)
+
+# Remembers which monthly periods were applied, so charges run exactly once
+scheduler = PaydayScheduler(SCHEDULE_FILE, hour=PAYDAY_HOUR)
+
+# Broadcasts waiting for delivery, kept on disk until Telegram accepts them
+outbox = Outbox(OUTBOX_FILE)
+
+# Administrator sets per chat, refreshed every few minutes or on promotion/demotion
+admin_cache = AdminCache()
+
+# With several replicas, only the holder of this lease writes and runs the scheduler
+lease = LeaderLease(LEADER_FILE) if LEADER_ELECTION else None
+
+metrics.gauge("outbox_pending", lambda: len(outbox))
+metrics.gauge("ledgers_loaded", lambda: len(ledgers.loaded()))
+metrics.gauge("ledger_users", lambda: sum(len(ledger.store) for ledger in ledgers.loaded()))
+
+# --- Utils ---
+
+def get_ledger(update: Update):
+    """Returns the ledger of the current group; private chats use the default group's ledger."""
+    chat = update.effective_chat
+    if chat.type == ChatType.PRIVATE:
+        return ledgers.get(GROUP_ID)
+    return ledgers.get(chat.id)
+
+def resolve_name(ledger, name):
+    """Returns the ledger's own spelling of `name`, which is matched case-insensitively."""
+    # An exact match wins, for older ledgers that have both "bob" and "Bob".
+    if name in ledger.store:
+        return name
+    return ledger.store.lookup.resolve(name) or name
+
+def not_found_reply(ledger, name):
+    suggestions = ledger.store.lookup.suggest(name)
+    if suggestions:
+        return f"❌ User '{name}' not found. Did you mean: {', '.join(suggestions)}?"
+    return f"❌ User '{name}' not found."
+
+def unlink(ledger, name):
+    """Drops the links from Telegram users to `name`; returns how many there were."""
+    aliases = {user_id: alias for user_id, alias in ledger.aliases.items() if alias != name}
+    removed = len(ledger.aliases) - len(aliases)
+    if removed:
+        ledgers.configure(ledger.chat_id, aliases=aliases)
+    return removed
+
+def parse_money(text):
+    """
+    Parses an amount typed with a decimal point or comma. Raises ValueError
+    unless it is a finite number of at most MAX_AMOUNT, so the ledger's
+    integer cents can't overflow.
+    """
+    amount = float(text.replace(",", "."))
+    if not math.isfinite(amount) or abs(amount) > MAX_AMOUNT:
+        raise ValueError(f"amount out of range: {text}")
+    return amount
+
+def parse_amount(ledger, text, currency=None):
+    """
+    Parses an amount with `parse_money`, given in `currency` or else the
+    ledger's own, and returns it in the ledger's currency. Raises ValueError
+    for a malformed amount and KeyError for a currency without an exchange
+    rate.
+    """
+    amount = parse_money(text)
+    if currency is None or currency == ledger.currency:
+        return amount
+    cents = rates.convert(to_cents(amount), currency, ledger.currency)
+    if cents is None:
+        raise KeyError(currency)
+    if abs(from_cents(cents)) > MAX_AMOUNT:
+        raise ValueError(f"amount out of range: {text} {currency}")
+    return from_cents(cents)
+
+def currency_arg(ledger, arg):
+    """Returns `arg` as a currency (the group's own or one in the rate table), or None if it isn't one."""
+    if arg == ledger.currency:
+        return arg
+    return rates.code(arg)
+
+def parse_currency_args(ledger, args):
+    """
+    Splits the arguments after an amount into its optional currency and the
+    first argument that isn't one. Returns (currency or None, unknown or None).
+    """
+    if not args:
+        return None, None
+    currency = currency_arg(ledger, args[0])
+    if currency is None:
+        return None, args[0]
+    return currency, args[1] if len(args) > 1 else None
+
+def no_rate_reply(ledger, currency):
+    """Explains why `currency`, as the user typed it, can't be converted."""
+    if rates.code(currency) is None:
+        return f"❌ There is no exchange rate for '{currency}', see /rates."
+    return f"❌ Can't convert {currency}: this group's currency '{ledger.currency}' has no exchange rate, see /rates."
+
+def converted(ledger, balance, currency):
+    """`balance` shown in `currency` as well, e.g. " (≈ 9.22 EUR)", or "" if it can't be converted."""
+    if currency is None or rates.code(currency) == rates.code(ledger.currency):
+        return ""
+    cents = rates.convert(to_cents(balance), ledger.currency, currency)
+    return "" if cents is None else f" (≈ {from_cents(cents)} {rates.code(currency)})"
+
+def is_leader():
+    return lease is None or lease.is_leader
+
+async def deny(update: Update, text):
+    """Refuses a command with a reply, or a button press with an alert."""
+    if update.callback_query:
+        await update.callback_query.answer(text, show_alert=True)
+    else:
+        await update.message.reply_text(text)
+
+# --- Decorators ---
+
+def instrumented(func):
+    """Records the call count, errors and latency of a handler under its command name."""
+    return metrics.timed("command", command=func.__name__.removesuffix("_command"))(func)
+
+def restricted(func):
+    """Restricts access to administrators and the group creator."""
+    @functools.wraps(func)
+    async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        user_id = update.effective_user.id
+        # Private chats have no administrators, so commands DM'd to the bot (which act
+        # on the default group's ledger) are checked against the admins of GROUP_ID.
+        chat = update.effective_chat
+        chat_id = GROUP_ID if chat.type == ChatType.PRIVATE else chat.id
+
+        start = time.perf_counter()
+        try:
+            is_admin = await admin_cache.is_admin(context.bot, chat_id, user_id)
+        except Exception as e:
+            logger.error(f"Error checking permissions: {e}")
+            await deny(update, "Error verifying permissions.")
+            return
+        finally:
+            metrics.observe("permission_check", time.perf_counter() - start)
+
+        if not is_admin:
+            await deny(update, "⛔ Permission denied. Admins only.")
+            return
+
+        return await func(update, context, *args, **kwargs)
+    return wrapped
+
+def leader_only(func):
+    """Lets only the leader replica run commands that change data; followers are read-only."""
+    @functools.wraps(func)
+    async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        if not is_leader():
+            await deny(update, "⏳ Changes are paused while the bot switches over, please retry in a few seconds.")
+            return
+        return await func(update, context, *args, **kwargs)
+    return wrapped
+
+# --- Commands ---
+
+@instrumented
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("👋 Hello! I am the Balance Bot. Use /help to see available commands.")
+
+@instrumented
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    help_text = (
+        "📋 **Available Commands:**\n\n"
+        "🟢 **Public:**\n"
+        "/balance [name] - Show a user's balance, or your own if you are linked\n"
+        "/all_balances [negative|positive] [name|asc|desc] [currency] - Show balances for all users\n"
+        "/history [name] [count] - Show the last changes to a balance\n"
+        "/settle - Show who should pay whom to settle all balances\n"
+        "/rates - Show the exchange rates of other currencies\n"
+        "/help - Show this message\n\n"
+        "🔒 **Admin Only:**\n"
+        "/add_user <name> [initial_balance] - Register a new user\n"
+        "/remove_user <name> - Remove a user\n"
+        "/add_amount <name> <amount> [currency] - Add funds to a user\n"
+        "/subtract_amount <name> <amount> [currency] - Deduct funds from a user\n"
+        "/batch - Apply many changes at once, one '<name> <amount>' per line\n"
+        "/panel - Pick a user and add or subtract preset amounts with buttons\n"
+        "/link <name> [user_id] - Link a Telegram user (or the one you reply to) to a name\n"
+        "/unlink <name> - Remove the links to a name\n"
+        "/currency <name> [currency] - Also show a user's balance in another currency\n"
+        "/setup [<currency> <import_amount> <payday_day> [timezone]] - Show or change this group's settings\n"
+        "/charges - List this group's recurring monthly charges\n"
+        "/add_charge <name> <amount> <day> - Add a recurring monthly charge\n"
+        "/remove_charge <name> - Remove a recurring charge\n"
+        "/export [from] [to] [name] [csv|json] - Download a statement for a date range\n"
+        "/settle apply - Record the settling transfers as one batch\n"
+        "/undo_payday - Revert the last monthly update\n"
+        "/stats - Show command latencies and bot statistics\n"
+    )
+    await update.message.reply_text(help_text, parse_mode="Markdown")
+
+async def chat_member_updated(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    admin_cache.on_member_updated(update.chat_member or update.my_chat_member)
+
+@instrumented
+async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("❓ Unknown command. Try /help.")
+
+# --- Public Commands ---
+
+@instrumented
+async def all_balances_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    if not len(ledger.store):
+        await update.message.reply_text("📭 No balances found.")
+        return
+
+    filter_name, sort_name = parse_view(context.args)
+    # Any other argument is a currency to show the balances in, e.g. "/all_balances EUR"
+    currency = None
+    for arg in context.args:
+        if arg.lower() in FILTERS or arg.lower() in SORTS:
+            continue
+        currency = currency_arg(ledger, arg)
+        if currency is None:
+            await update.message.reply_text(
+                f"❓ Unknown argument '{arg}'. Usage: /all_balances [negative|positive] [name|asc|desc] [currency]"
+            )
+            return
+    if currency == ledger.currency or currency == rates.code(ledger.currency):
+        currency = None
+    elif currency is not None and rates.factor(ledger.currency, currency) is None:
+        await update.message.reply_text(no_rate_reply(ledger, currency))
+        return
+    text, keyboard = ledger.report.page(filter_name, sort_name, currency=currency)
+    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=keyboard)
+
+@instrumented
+async def all_balances_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, filter_name, sort_name, page, *currency = query.data.split(":")
+    if filter_name not in FILTERS or sort_name not in SORTS:
+        return
+    ledger = get_ledger(update)
+    currency = currency[0] if currency else None
+    if currency is not None and rates.factor(ledger.currency, currency) is None:
+        # The rate was dropped from the table since the message was sent
+        return
+    text, keyboard = ledger.report.page(filter_name, sort_name, int(page), currency)
+    await query.edit_message_text(text, parse_mode="Markdown", reply_markup=keyboard)
+
+@instrumented
+async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    if context.args:
+        name = resolve_name(ledger, context.args[0])
+    else:
+        # Without a name, show the balance linked to the caller with /link
+        name = ledger.aliases.get(str(update.effective_user.id))
+        if name is None:
+            await update.message.reply_text("Usage: /balance <name> (or ask an admin to /link you to your name)")
+            return
+
+    balance = ledger.store.get(name)
+    
+    if balance is not None:
+        extra = converted(ledger, balance, ledger.currencies.get(name))
+        await update.message.reply_text(f"💰 Balance for **{name}**: {balance} {ledger.currency}{extra}", parse_mode="Markdown")
+    else:
+        await update.message.reply_text(not_found_reply(ledger, name))
+
+# Inline answers are balances, so Telegram may only reuse them for a few seconds.
+INLINE_CACHE_TIME = 10
+INLINE_RESULTS = 10
+
+@instrumented
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answers "@bot <name>" from any chat with matching balances of the default group, without a command round trip."""
+    query = update.inline_query
+    ledger = ledgers.get(GROUP_ID)
+    linked = ledger.aliases.get(str(query.from_user.id))
+    # Anyone can type the bot's name, so balances are only shown to linked members and admins.
+    if linked is None:
+        try:
+            allowed = await admin_cache.is_admin(context.bot, GROUP_ID, query.from_user.id)
+        except Exception as e:
+            logger.error(f"Error checking permissions: {e}")
+            allowed = False
+        if not allowed:
+            await query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True)
+            return
+
+    text = query.query.strip()
+    if text:
+        exact = ledger.store.lookup.resolve(text)
+        names = [exact] if exact else []
+        names += [name for name in ledger.store.lookup.suggest(text, limit=INLINE_RESULTS) if name != exact]
+    else:
+        names = [linked] if linked else []
+
+    results = []
+    for name in names[:INLINE_RESULTS]:
+        balance = ledger.store.get(name)
+        if balance is None:
+            continue
+        text = f"{name}: {balance} {ledger.currency}{converted(ledger, balance, ledger.currencies.get(name))}"
+        results.append(InlineQueryResultArticle(
+            id=str(len(results)),
+            title=text,
+            input_message_content=InputTextMessageContent(f"💰 Balance for {text}"),
+        ))
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+@instrumented
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    args = list(context.args)
+    limit = 10
+    if args and args[-1].isdigit():
+        limit = max(1, min(int(args.pop()), 50))
+    if args:
+        name = resolve_name(ledger, args[0])
+    else:
+        name = ledger.aliases.get(str(update.effective_user.id))
+        if name is None:
+            await update.message.reply_text("Usage: /history <name> [count]")
+            return
+
+    entries = ledger.store.history.tail(name, limit)
+    # Removed users keep their history; names that never existed only match ledger-wide credits.
+    if name not in ledger.store and not any(entry["user"] == name for entry in entries):
+        await update.message.reply_text(not_found_reply(ledger, name))
+        return
+    if not entries:
+        await update.message.reply_text(f"📭 No history for '{name}' yet.")
+        return
+
+    tz = get_timezone(ledger.timezone)
+    lines = [f"🧾 **Last {len(entries)} changes for {name}:**"]
+    for entry in entries:
+        date = datetime.datetime.fromtimestamp(entry["ts"], tz).strftime("%Y-%m-%d %H:%M")
+        line = f"{date} {OP_LABELS.get(entry['op'], entry['op'])} {entry['delta']:+} {ledger.currency}"
+        if entry["balance"] is not None:
+            line += f" → {entry['balance']} {ledger.currency}"
+        lines.append(line)
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+@instrumented
+async def settle_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args and context.args[0].lower() == "apply":
+        await apply_settlement(update, context)
+        return
+
+    ledger = get_ledger(update)
+    transfers, remainder = plan_transfers(ledger.store.items())
+    if not transfers:
+        await update.message.reply_text("🤝 Nothing to settle.")
+        return
+
+    lines = [f"🤝 **Settle up in {len(transfers)} transfers:**"]
+    for debtor, creditor, amount in transfers:
+        lines.append(f"{debtor} → {creditor}: {amount} {ledger.currency}")
+    if remainder:
+        lines.append(f"\n⚖️ Balances don't add up to zero, {remainder} {ledger.currency} stays on the ledger.")
+    for message in chunk_lines(lines):
+        await update.message.reply_text(message, parse_mode="Markdown")
+
+@restricted
+@leader_only
+async def apply_settlement(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    # Planned and applied without awaiting in between, so the batch matches the balances it was computed from.
+    transfers, remainder = plan_transfers(ledger.store.items())
+    if not transfers:
+        await update.message.reply_text("🤝 Nothing to settle.")
+        return
+
+    ledger.store.apply_batch(transfer_changes(transfers), admin=update.effective_user.id)
+    total = sum(amount for _, _, amount in transfers)
+    reply = f"✅ Recorded {len(transfers)} transfers ({round(total, 2)} {ledger.currency}) as one batch."
+    if remainder:
+        reply += f" {remainder} {ledger.currency} stays on the ledger."
+    await update.message.reply_text(reply)
+
+@instrumented
+async def rates_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    if not len(rates):
+        await update.message.reply_text("💱 No exchange rates loaded, amounts are in this group's currency only.")
+        return
+
+    if rates.code(ledger.currency) is None:
+        # The group's currency isn't in the table, so show the table as it is
+        lines = [f"💱 **Exchange rates** (per 1 {rates.base or 'unit of the base currency'}):"]
+        lines += [f"{code}: {rate}" for code, rate in rates.items()]
+    else:
+        lines = [f"💱 **Exchange rates** (1 {ledger.currency} =):"]
+        lines += [f"{code}: {round(rates.factor(ledger.currency, code), 4)}" for code, _ in rates.items()]
+    for message in chunk_lines(lines):
+        await update.message.reply_text(message, parse_mode="Markdown")
+
+# --- Admin Commands ---
+
+@instrumented
+@restricted
+@leader_only
+async def add_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text("Usage: /add_user <name> [initial_balance]")
+        return
+    
+    name = context.args[0]
+    initial_balance = 0.0
+    
+    if len(context.args) >= 2:
+        try:
+            initial_balance = parse_money(context.args[1])
+        except ValueError:
+            await update.message.reply_text(f"❌ Invalid amount, expected a number up to {MAX_AMOUNT:,}.")
+            return
+
+    ledger = get_ledger(update)
+    # "bob" and "Bob" are the same user, so a name that only differs in case is taken too.
+    name = resolve_name(ledger, name)
+    async with ledger.store.lock(name):
+        if name in ledger.store:
+            reply = f"⚠️ User '{name}' already exists. Balance: {ledger.store.get(name)} {ledger.currency}"
+        else:
+            ledger.store.add_user(name, round(initial_balance, 2), admin=update.effective_user.id)
+            reply = f"✅ User '{name}' added with {initial_balance} {ledger.currency}."
+
+    await update.message.reply_text(reply)
+
+@instrumented
+@restricted
+@leader_only
+async def remove_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text("Usage: /remove_user <name>")
+        return
+    
+    ledger = get_ledger(update)
+    name = resolve_name(ledger, context.args[0])
+    async with ledger.store.lock(name):
+        if name in ledger.store:
+            ledger.store.remove_user(name, admin=update.effective_user.id)
+            unlink(ledger, name)
+            if name in ledger.currencies:
+                ledgers.configure(ledger.chat_id, currencies={k: v for k, v in ledger.currencies.items() if k != name})
+            reply = f"🗑️ User '{name}' removed."
+        else:
+            reply = not_found_reply(ledger, name)
+
+    await update.message.reply_text(reply)
+
+@instrumented
+@restricted
+@leader_only
+async def add_amount_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if len(context.args) < 2:
+        await update.message.reply_text("Usage: /add_amount <name> <amount> [currency]")
+        return
+    
+    ledger = get_ledger(update)
+    currency, unknown = parse_currency_args(ledger, context.args[2:])
+    if unknown:
+        await update.message.reply_text(f"❓ Unknown argument '{unknown}'. Usage: /add_amount <name> <amount> [currency]")
+        return
+    try:
+        amount = parse_amount(ledger, context.args[1], currency)
+    except ValueError:
+        await update.message.reply_text(f"❌ Invalid amount, expected a number up to {MAX_AMOUNT:,}.")
+        return
+    except KeyError:
+        await update.message.reply_text(no_rate_reply(ledger, currency))
+        return
+
+    name = resolve_name(ledger, context.args[0])
+    async with ledger.store.lock(name):
+        if name in ledger.store:
+            new_balance = ledger.store.adjust(name, amount, admin=update.effective_user.id)
+            given = f" ({context.args[1]} {currency})" if currency and currency != ledger.currency else ""
+            reply = f"📈 Added {amount} {ledger.currency}{given} to {name}. New balance: {new_balance} {ledger.currency}"
+        else:
+            reply = not_found_reply(ledger, name)
+
+    await update.message.reply_text(reply)
+
+@instrumented
+@restricted
+@leader_only
+async def subtract_amount_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if len(context.args) < 2:
+        await update.message.reply_text("Usage: /subtract_amount <name> <amount> [currency]")
+        return
+    
+    ledger = get_ledger(update)
+    currency, unknown = parse_currency_args(ledger, context.args[2:])
+    if unknown:
+        await update.message.reply_text(f"❓ Unknown argument '{unknown}'. Usage: /subtract_amount <name> <amount> [currency]")
+        return
+    try:
+        amount = parse_amount(ledger, context.args[1], currency)
+    except ValueError:
+        await update.message.reply_text(f"❌ Invalid amount, expected a number up to {MAX_AMOUNT:,}.")
+        return
+    except KeyError:
+        await update.message.reply_text(no_rate_reply(ledger, currency))
+        return
+
+    name = resolve_name(ledger, context.args[0])
+    async with ledger.store.lock(name):
+        if name in ledger.store:
+            new_balance = ledger.store.adjust(name, -amount, admin=update.effective_user.id)
+            given = f" ({context.args[1]} {currency})" if currency and currency != ledger.currency else ""
+            reply = f"📉 Deducted {amount} {ledger.currency}{given} from {name}. New balance: {new_balance} {ledger.currency}"
+        else:
+            reply = not_found_reply(ledger, name)
+
+    await update.message.reply_text(reply)
+
+def parse_batch(text):
+    """
+    Parses one `name amount` pair per line (amounts may be negative and use a
+    decimal comma). Returns the list of (name, amount) changes and a list of
+    error messages for the lines that could not be parsed.
+    """
+    changes = []
+    errors = []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) != 2:
+            errors.append(f"Line {line_no}: expected '<name> <amount>'.")
+            continue
+        try:
+            amount = parse_money(parts[1])
+        except ValueError:
+            errors.append(f"Line {line_no}: invalid amount '{parts[1]}'.")
+            continue
+        changes.append((parts[0], amount))
+    return changes, errors
+
+@instrumented
+@restricted
+@leader_only
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Everything after the command itself, e.g. "/batch\nBob 5\nEve -3.5"
+    text = update.message.text.split(maxsplit=1)
+    changes, errors = parse_batch(text[1] if len(text) > 1 else "")
+
+    if not changes and not errors:
+        await update.message.reply_text("Usage: /batch followed by one '<name> <amount>' per line")
+        return
+    if errors:
+        await update.message.reply_text("❌ Batch rejected, nothing was applied:\n" + "\n".join(errors))
+        return
+
+    # Validation and application never await, so the batch is atomic with respect to other handlers.
+    ledger = get_ledger(update)
+    changes = [(resolve_name(ledger, name), amount) for name, amount in changes]
+    try:
+        entries = ledger.store.apply_batch(changes, admin=update.effective_user.id)
+    except KeyError as e:
+        lines = ["❌ Batch rejected, nothing was applied. Unknown users:"]
+        for name in e.args[0]:
+            suggestions = ledger.store.lookup.suggest(name)
+            lines.append(f"{name} (did you mean {', '.join(suggestions)}?)" if suggestions else name)
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    lines = [f"🧾 Batch applied ({len(entries)} changes):"]
+    for entry in entries:
+        lines.append(f"{entry['user']}: {entry['delta']:+} {ledger.currency} → {entry['balance']} {ledger.currency}")
+    await update.message.reply_text("\n".join(lines))
+
+def panel_users(ledger, page):
+    keyboard, page, pages = users_keyboard(ledger.report.view(), page)
+    title = "🎛 Pick a user:" if pages == 1 else f"🎛 Pick a user (page {page + 1}/{pages}):"
+    return title, keyboard
+
+def panel_user_text(ledger, name, balance):
+    return f"👤 {name}: {balance} {ledger.currency}\nTap an amount to add or subtract it."
+
+@instrumented
+@restricted
+async def panel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    if not len(ledger.store):
+        await update.message.reply_text("📭 No users yet, add one with /add_user.")
+        return
+    text, keyboard = panel_users(ledger, 0)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+@instrumented
+@restricted
+async def panel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    action, args = parse_callback(query.data)
+    ledger = get_ledger(update)
+    if action == "a":
+        await apply_panel_amount(update, context, ledger, int(args[0]), int(args[1]), args[2])
+        return
+
+    await query.answer()
+    if action == "u":
+        name = find_name(ledger.store, args[1])
+        balance = ledger.store.get(name) if name else None
+        if balance is not None:
+            await query.edit_message_text(panel_user_text(ledger, name, balance), reply_markup=amounts_keyboard(name, int(args[0]), ledger.currency))
+            return
+    text, keyboard = panel_users(ledger, int(args[0]))
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+@leader_only
+async def apply_panel_amount(update: Update, context: ContextTypes.DEFAULT_TYPE, ledger, cents, page, key):
+    query = update.callback_query
+    amount = cents / 100
+    name = find_name(ledger.store, key)
+    balance = None
+    if name is not None:
+        async with ledger.store.lock(name):
+            if name in ledger.store:
+                balance = ledger.store.adjust(name, amount, admin=update.effective_user.id)
+    if balance is None:
+        await query.answer(f"❌ User '{name or key}' not found.", show_alert=True)
+        return
+
+    await query.answer(f"{amount:+} {ledger.currency} → {balance} {ledger.currency}")
+    await query.edit_message_text(panel_user_text(ledger, name, balance), reply_markup=amounts_keyboard(name, page, ledger.currency))
+
+@instrumented
+@restricted
+@leader_only
+async def link_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reply_to = update.message.reply_to_message
+    if not context.args or (reply_to is None and len(context.args) < 2):
+        await update.message.reply_text("Usage: reply to a user's message with /link <name>, or /link <name> <user_id>")
+        return
+
+    if reply_to is not None and reply_to.from_user is not None:
+        user_id = reply_to.from_user.id
+        label = reply_to.from_user.full_name
+    else:
+        try:
+            user_id = int(context.args[1])
+        except ValueError:
+            await update.message.reply_text("❌ Invalid user id.")
+            return
+        label = str(user_id)
+
+    ledger = get_ledger(update)
+    name = resolve_name(ledger, context.args[0])
+    if name not in ledger.store:
+        await update.message.reply_text(not_found_reply(ledger, name))
+        return
+
+    ledgers.configure(ledger.chat_id, aliases={**ledger.aliases, str(user_id): name})
+    await update.message.reply_text(f"🔗 {label} is now linked to '{name}'; /balance alone shows their balance.")
+
+@instrumented
+@restricted
+@leader_only
+async def unlink_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text("Usage: /unlink <name>")
+        return
+
+    ledger = get_ledger(update)
+    name = resolve_name(ledger, context.args[0])
+    if unlink(ledger, name):
+        await update.message.reply_text(f"✂️ '{name}' is no longer linked to any Telegram user.")
+    else:
+        await update.message.reply_text(f"❌ No Telegram user is linked to '{name}'.")
+
+@instrumented
+@restricted
+@leader_only
+async def currency_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args or len(context.args) > 2:
+        await update.message.reply_text("Usage: /currency <name> [currency] (without a currency, the preference is cleared)")
+        return
+
+    ledger = get_ledger(update)
+    name = resolve_name(ledger, context.args[0])
+    if name not in ledger.store:
+        await update.message.reply_text(not_found_reply(ledger, name))
+        return
+
+    currencies = dict(ledger.currencies)
+    if len(context.args) == 1:
+        currencies.pop(name, None)
+        reply = f"✅ {name}'s balance is shown in {ledger.currency} only."
+    else:
+        currency = rates.code(context.args[1])
+        if currency is None or rates.factor(ledger.currency, currency) is None:
+            await update.message.reply_text(no_rate_reply(ledger, context.args[1]))
+            return
+        currencies[name] = currency
+        reply = f"✅ {name}'s balance is now also shown in {currency}."
+    ledgers.configure(ledger.chat_id, currencies=currencies)
+    await update.message.reply_text(reply)
+
+@instrumented
+@restricted
+@leader_only
+async def setup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    if not context.args:
+        await update.message.reply_text(
+            f"⚙️ Currency: {ledger.currency}\n"
+            f"Monthly import: {ledger.import_amount} {ledger.currency}\n"
+            f"Payday: day {ledger.payday_day} of the month\n"
+            f"Timezone: {ledger.timezone or 'server time'}\n\n"
+            "Usage: /setup <currency> <import_amount> <payday_day> [timezone]"
+        )
+        return
+    if len(context.args) not in (3, 4):
+        await update.message.reply_text("Usage: /setup <currency> <import_amount> <payday_day> [timezone]")
+        return
+
+    try:
+        import_amount = parse_money(context.args[1])
+        payday_day = int(context.args[2])
+    except ValueError:
+        await update.message.reply_text("❌ Invalid amount or day format.")
+        return
+    if not 1 <= payday_day <= 28:
+        await update.message.reply_text("❌ Payday must be a day between 1 and 28.")
+        return
+
+    currency = context.args[0]
+    # Any label will do until exchange rates are configured; then it must be one the table knows.
+    if len(rates) and currency_arg(ledger, currency) is None:
+        await update.message.reply_text(no_rate_reply(ledger, currency))
+        return
+    code = rates.code(currency)
+    if code is not None and currency.upper() == code:
+        currency = code
+    same_currency = currency == ledger.currency or (code is not None and code == rates.code(ledger.currency))
+    if not same_currency and len(ledger.store):
+        # Relabelling would silently reinterpret every balance (and charge) in the new currency.
+        await update.message.reply_text(
+            f"❌ This group's balances are in {ledger.currency}, so its currency can't change while it has users."
+        )
+        return
+
+    settings = {"currency": currency, "import_amount": import_amount, "payday_day": payday_day}
+    if len(context.args) == 4:
+        if not is_valid_timezone(context.args[3]):
+            await update.message.reply_text(f"❌ Unknown timezone '{context.args[3]}', e.g. Europe/Rome.")
+            return
+        settings["timezone"] = context.args[3]
+
+    ledgers.configure(ledger.chat_id, **settings)
+    await update.message.reply_text(
+        f"✅ Settings saved: {import_amount} {currency} every month on day {payday_day}."
+    )
+
+@instrumented
+@restricted
+async def charges_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    lines = ["🗓️ **Recurring charges:**"]
+    for charge in charges_of(ledger.settings()):
+        lines.append(f"{charge['name']}: {charge['amount']} {ledger.currency} on day {charge['day']}")
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+@instrumented
+@restricted
+@leader_only
+async def add_charge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if len(context.args) != 3:
+        await update.message.reply_text("Usage: /add_charge <name> <amount> <day>")
+        return
+
+    name = context.args[0]
+    try:
+        amount = parse_money(context.args[1])
+        day = int(context.args[2])
+    except ValueError:
+        await update.message.reply_text("❌ Invalid amount or day format.")
+        return
+    if not 1 <= day <= 28:
+        await update.message.reply_text("❌ Day must be between 1 and 28.")
+        return
+
+    ledger = get_ledger(update)
+    if any(charge["name"] == name for charge in charges_of(ledger.settings())):
+        await update.message.reply_text(f"⚠️ Charge '{name}' already exists.")
+        return
+
+    charges = ledger.charges + [{"name": name, "amount": amount, "day": day}]
+    ledgers.configure(ledger.chat_id, charges=charges)
+    await update.message.reply_text(f"✅ Charge '{name}' added: {amount} {ledger.currency} every month on day {day}.")
+
+@instrumented
+@restricted
+@leader_only
+async def remove_charge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text("Usage: /remove_charge <name>")
+        return
+
+    name = context.args[0]
+    ledger = get_ledger(update)
+    charges = [charge for charge in ledger.charges if charge["name"] != name]
+    if len(charges) == len(ledger.charges):
+        await update.message.reply_text(f"❌ Charge '{name}' not found.")
+        return
+
+    ledgers.configure(ledger.chat_id, charges=charges)
+    await update.message.reply_text(f"🗑️ Charge '{name}' removed.")
+
+@instrumented
+@restricted
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    fmt = "csv"
+    dates = []
+    name = None
+    for arg in context.args:
+        if arg.lower() in ("csv", "json"):
+            fmt = arg.lower()
+            continue
+        try:
+            dates.append(datetime.date.fromisoformat(arg))
+        except ValueError:
+            name = resolve_name(ledger, arg)
+    if len(dates) > 2:
+        await update.message.reply_text("Usage: /export [from YYYY-MM-DD] [to YYYY-MM-DD] [name] [csv|json]")
+        return
+
+    # Defaults to the current month; both days are included.
+    tz = get_timezone(ledger.timezone)
+    today = datetime.datetime.now(tz).date()
+    first = dates[0] if dates else today.replace(day=1)
+    last = dates[1] if len(dates) == 2 else today
+    start = datetime.datetime.combine(first, datetime.time(), tz).timestamp()
+    end = datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time(), tz).timestamp()
+
+    # Rows go straight from the database cursor to a temporary file, never all in memory at once.
+    with tempfile.TemporaryFile() as f:
+        count = await write_statement(ledger.store.history.range(start, end, name), f, fmt, tz)
+        if not count:
+            await update.message.reply_text(f"📭 No transactions between {first} and {last}.")
+            return
+        filename = f"statement_{name or ledger.chat_id}_{first}_{last}.{fmt}"
+        await update.message.reply_document(
+            document=f, filename=filename, caption=f"🧾 {count} transactions between {first} and {last}"
+        )
+
+@instrumented
+@restricted
+@leader_only
+async def undo_payday_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    ledger = get_ledger(update)
+    bulk = ledger.store.undo_bulk(admin=update.effective_user.id)
+    if bulk is None:
+        await update.message.reply_text("❌ There is no monthly update to undo.")
+        return
+
+    await update.message.reply_text(
+        f"↩️ Reverted {bulk['note'] or 'the last monthly update'}: "
+        f"removed {bulk['delta']} {ledger.currency} from {len(bulk['names'])} users."
+    )
+
+@instrumented
+@restricted
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lines = ["📈 **Bot statistics:**"]
+    for (name, labels), histogram in sorted(metrics.histograms.items()):
+        label = " ".join([name] + [str(value) for _, value in labels])
+        lines.append(
+            f"{label}: {histogram.count} calls, "
+            f"avg {histogram.sum / histogram.count * 1000:.1f} ms, "
+            f"p99 ≤ {histogram.quantile(0.99) * 1000:.0f} ms"
+        )
+    for (name, labels), value in sorted(metrics.counters.items()):
+        lines.append(f"{' '.join([name] + [str(value) for _, value in labels])}: {value}")
+    for name, callback in sorted(metrics.gauges.items()):
+        lines.append(f"{name}: {callback()}")
+    for message in chunk_lines(lines):
+        await update.message.reply_text(message)
+
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Tells the admin when a change could not be saved; any other error is only logged."""
+    if isinstance(context.error, StorageError):
+        # Already logged by the store, which left the ledger as it was.
+        if isinstance(update, Update) and (update.callback_query or update.message):
+            await deny(update, "❌ Error saving data.")
+        return
+    logger.error("Error while handling an update", exc_info=context.error)
+
+# --- Background Task ---
+
+def apply_payday(ledger, charge, period):
+    """Adds a recurring charge to everyone, marks its period as applied and queues the report for the group."""
+    store = ledger.store
+    note = f"{charge['name']} {period}"
+    last_bulk = store.last_bulk()
+    if last_bulk is not None and last_bulk["note"] == note:
+        # Credited right before a crash that came before the mark below
+        logger.warning(f"Charge '{charge['name']}' for {period} was already applied to chat {ledger.chat_id}.")
+    elif len(store):
+        # One ledger-wide operation and one journal entry, which /undo_payday can revert.
+        # Both backends make it durable before returning, so the mark can't outlive it.
+        store.credit_all(charge["amount"], note=note)
+    scheduler.mark(ledger.chat_id, charge, period)
+    if not len(store):
+        return
+
+    # Prepare report
+    if charge["name"] == DEFAULT_CHARGE:
+        title = "✨ **Monthly Subscription Update** ✨"
+    else:
+        title = f"✨ **Monthly Update: {charge['name']}** ✨"
+    lines = [title,  f"💰 Added {charge['amount']} {ledger.currency} to everyone!\n"]
+    lines.append("📊 **Current Balances:**")
+    # Rendered through the report cache, so /all_balances right after the payday reuses the lines.
+    lines.extend(ledger.report.lines())
+
+    # Large ledgers don't fit in one message, so the report is sent in chunks.
+    # The outbox keeps them until delivered, retrying across restarts if needed.
+    outbox.enqueue_many(ledger.chat_id, chunk_lines(lines), parse_mode="Markdown")
+
+async def monthly_subscription_task(application: Application):
+    """
+    Applies every group's recurring charges at their exact fire time.
+    Periods missed while the bot was down are caught up on the first check after startup.
+    Wakes at least every hour to pick up settings changes and unload idle ledgers.
+    """
+    while True:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        wakeup = now + datetime.timedelta(hours=1)
+
+        for chat_id in ledgers.chat_ids():
+            settings = ledgers.settings(chat_id)
+            for charge in charges_of(settings):
+                # One broken group or charge must not stop the paydays of all the others.
+                try:
+                    tz = get_timezone(settings["timezone"])
+                    for period in scheduler.due(chat_id, charge, tz, now):
+                        if not is_leader():
+                            # Usually a stall past the local lease expiry: coordination_task renews
+                            # the lease or shuts this replica down, so retry shortly instead of stopping.
+                            wakeup = min(wakeup, now + datetime.timedelta(seconds=5))
+                            break
+                        logger.info(f"Applying charge '{charge['name']}' for {period} to chat {chat_id}...")
+                        apply_payday(ledgers.get(chat_id), charge, period)
+                    wakeup = min(wakeup, scheduler.next_fire(charge, tz, now))
+                except Exception:
+                    logger.exception(f"Error applying charge '{charge['name']}' to chat {chat_id}")
+
+        # Only ledgers of recently active groups stay in memory
+        await ledgers.evict_idle()
+
+        delay = (wakeup - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        await asyncio.sleep(max(delay, 1))
+
+def start_leader_duties(application: Application):
+    """Starts what only one replica may run: the payday scheduler and the delivery of queued reports."""
+    scheduler.load()
+    outbox.load()
+    outbox.start(application.bot)
+    application.bot_data["monthly_task"] = asyncio.create_task(monthly_subscription_task(application))
+
+async def coordination_task(application: Application):
+    """
+    Renews the leader lease, or waits to take it over. Followers meanwhile
+    follow the leader's writes so they can answer read commands. A leader
+    that loses its lease (e.g. it stalled for longer than the lease) stops
+    writing and shuts down, to come back as a follower.
+    """
+    while True:
+        was_leader = lease.held
+        # Waits on the database lock while another replica holds it, so off the event loop
+        if await asyncio.to_thread(lease.try_acquire):
+            if not was_leader:
+                logger.info(f"This replica ({lease.owner}) is now the leader.")
+                ledgers.promote()
+                start_leader_duties(application)
+        elif was_leader:
+            logger.critical("Lost the leader lease, shutting down without writing.")
+            ledgers.demote()
+            await outbox.stop()
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        else:
+            ledgers.refresh()
+            await ledgers.evict_idle()
+        await asyncio.sleep(lease.ttl / 3)
+
+async def rates_task():
+    """Picks up a replaced rates file, e.g. one written by a cron job that fetches fresh rates."""
+    while True:
+        await asyncio.sleep(60)
+        rates.refresh()
+
+async def post_init(application: Application):
+    ledgers.load_settings()
+    rates.load()
+    application.bot_data["rates_task"] = asyncio.create_task(rates_task())
+    # Ledgers are opened on first use, so a large ledger doesn't delay startup.
+    if lease is None:
+        start_leader_duties(application)
+    else:
+        # Read-only until the lease is taken, which the first iteration tries right away
+        ledgers.read_only = True
+        application.bot_data["coordination_task"] = asyncio.create_task(coordination_task(application))
+    if METRICS_PORT:
+        application.bot_data["metrics_runner"] = await serve_metrics("127.0.0.1", METRICS_PORT)
+
+async def post_shutdown(application: Application):
+    if "metrics_runner" in application.bot_data:
+        await application.bot_data["metrics_runner"].cleanup()
+    for name in ("coordination_task", "monthly_task", "rates_task"):
+        if name in application.bot_data:
+            application.bot_data[name].cancel()
+    await outbox.stop()
+    await ledgers.close()
+    if lease is not None:
+        # Only after the final flush, so the next leader starts from complete files
+        await asyncio.to_thread(lease.release)
+        lease.close()
+
+# --- Main ---
+
+def run():
+    """Builds the application and serves updates until interrupted (see main.py)."""
+    if ERRORS:
+        for error in ERRORS:
+            logger.error(error)
+        exit(1)
+
+    logger.info("Starting Balance Bot...")
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(True)
+        # Every Bot API call, replies included, goes through per-chat and global flood limits
+        .rate_limiter(TokenBucketRateLimiter())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # Public
+    app.add_handler(CommandHandler("start", start_command))
+    app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("balance", balance_command))
+    app.add_handler(CommandHandler("history", history_command))
+    app.add_handler(CommandHandler("all_balances", all_balances_command))
+    app.add_handler(CommandHandler("settle", settle_command))
+    app.add_handler(CommandHandler("rates", rates_command))
+    app.add_handler(InlineQueryHandler(inline_query))
+    app.add_handler(CallbackQueryHandler(all_balances_page_callback, pattern=f"^{CALLBACK_PREFIX}:"))
+
+    # Restricted
+    app.add_handler(CommandHandler("add_user", add_user_command))
+    app.add_handler(CommandHandler("remove_user", remove_user_command))
+    app.add_handler(CommandHandler("add_amount", add_amount_command))
+    app.add_handler(CommandHandler("subtract_amount", subtract_amount_command))
+    app.add_handler(CommandHandler("batch", batch_command))
+    app.add_handler(CommandHandler("panel", panel_command))
+    app.add_handler(CallbackQueryHandler(panel_callback, pattern=f"^{PANEL_PREFIX}:"))
+    app.add_handler(CommandHandler("link", link_command))
+    app.add_handler(CommandHandler("unlink", unlink_command))
+    app.add_handler(CommandHandler("currency", currency_command))
+    app.add_handler(CommandHandler("setup", setup_command))
+    app.add_handler(CommandHandler("charges", charges_command))
+    app.add_handler(CommandHandler("add_charge", add_charge_command))
+    app.add_handler(CommandHandler("remove_charge", remove_charge_command))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CommandHandler("undo_payday", undo_payday_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+
+    # Keeps the admin cache in sync with promotions and demotions
+    app.add_handler(ChatMemberHandler(chat_member_updated, ChatMemberHandler.ANY_CHAT_MEMBER))
+
+    # Unknown
+    app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+
+    # Storage failures escape the mutating handlers and are reported here
+    app.add_error_handler(error_handler)
+
+    # chat_member updates are only delivered when explicitly requested
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+        asyncio.run(run_webhook(
+            app,
+            WEBHOOK_LISTEN,
+            WEBHOOK_PORT,
+            WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            webhook_url=WEBHOOK_URL,
+            allowed_updates=Update.ALL_TYPES,
+        ))
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,85 @@
+"""
+The bot's configuration, read from the environment (and `.env`) on import.
+
+Invalid values don't stop the import: they are listed in `ERRORS`, so the
+bot can refuse to start and `python main.py --check` can report every
+problem at once.
+"""
+import os
+from dotenv import load_dotenv
+from scheduler import is_valid_timezone
+
+load_dotenv()
+
+ERRORS = []
+
+
+def _number(name, convert, default=None):
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return convert(value)
+    except ValueError:
+        ERRORS.append(f"{name} must be a number, got '{value}'.")
+        return default
+
+
+# Constants and Configuration
+TOKEN = os.getenv("TELEGRAM_TOKEN")
+GROUP_ID = _number("GROUP_ID", int)
+DEFAULT_IMPORT_AMOUNT = _number("DEFAULT_IMPORT_AMOUNT", float)
+CURRENCY = os.getenv("CURRENCY", "$")
+PAYDAY_DAY = _number("PAYDAY_DAY", int)
+STORAGE = os.getenv("STORAGE", "json")
+TIMEZONE = os.getenv("TIMEZONE")
+PAYDAY_HOUR = _number("PAYDAY_HOUR", int, 8)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = _number("WEBHOOK_PORT", int, 8080)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+METRICS_PORT = _number("METRICS_PORT", int)
+LEADER_ELECTION = os.getenv("LEADER_ELECTION", "").lower() in ("1", "true", "yes")
+
+# Validation
+_missing = [name for name in ("TELEGRAM_TOKEN", "GROUP_ID", "DEFAULT_IMPORT_AMOUNT", "PAYDAY_DAY") if not os.getenv(name)]
+if _missing:
+    ERRORS.append(f"Missing environment variables: {', '.join(_missing)}. Please check your .env file.")
+
+if STORAGE not in ("json", "sqlite"):
+    ERRORS.append("STORAGE must be either 'json' or 'sqlite'.")
+
+if BOT_MODE not in ("polling", "webhook"):
+    ERRORS.append("BOT_MODE must be either 'polling' or 'webhook'.")
+
+# Without it, anyone who can reach the port could post updates as an admin
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    ERRORS.append("WEBHOOK_SECRET is required when BOT_MODE is 'webhook'.")
+
+if PAYDAY_HOUR is not None and not 0 <= PAYDAY_HOUR <= 23:
+    ERRORS.append(f"PAYDAY_HOUR must be an hour between 0 and 23, got {PAYDAY_HOUR}.")
+
+if TIMEZONE and not is_valid_timezone(TIMEZONE):
+    ERRORS.append(f"Unknown TIMEZONE '{TIMEZONE}'.")
+
+# Data files, relative to the working directory
+BALANCES_FILE = "balances.json"
+LEDGERS_DIR = "ledgers"
+DATABASE_FILE = "balances.db"
+HISTORY_FILE = "history.db"
+GROUPS_FILE = "groups.json"
+SCHEDULE_FILE = "schedule.json"
+OUTBOX_FILE = "outbox.json"
+LEADER_FILE = "leader.db"
+RATES_FILE = "rates.json"
+
+
+def open_backend():
+    """Creates the configured storage backend; neither backend touches the disk until a ledger is opened."""
+    if STORAGE == "sqlite":
+        from sqlite_store import SqliteBackend
+        return SqliteBackend(DATABASE_FILE)
+    from store import JsonBackend
+    return JsonBackend(GROUP_ID, BALANCES_FILE, directory=LEDGERS_DIR, history_path=HISTORY_FILE)
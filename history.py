@@ -0,0 +1,168 @@
+import io
+import csv
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import datetime
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    op TEXT NOT NULL,
+    user TEXT NOT NULL,
+    delta REAL,
+    balance REAL,
+    admin INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS transactions_by_user ON transactions (chat_id, user, id);
+CREATE INDEX IF NOT EXISTS transactions_by_time ON transactions (chat_id, ts);
+"""
+
+# Ledger-wide operations (monthly credits and their undo) are one row under this name
+ALL_USERS = "*"
+
+COLUMNS = ("ts", "op", "user", "delta", "balance", "admin")
+
+OP_LABELS = {
+    "add_user": "added",
+    "adjust": "adjusted",
+    "batch": "batch",
+    "remove_user": "removed",
+    "credit_all": "monthly credit",
+    "undo_bulk": "monthly credit undone",
+}
+
+
+def open_history_db(path):
+    """Opens (creating if needed) a database holding only the transaction history, for the JSON backend."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(TRANSACTIONS_SCHEMA)
+    return conn
+
+
+class HistoryLog:
+    """
+    The transaction history of one group: one row per change in the
+    `transactions` table, indexed by user for `tail` and by time for `range`.
+    The SQLite store writes its rows in the same transaction as the balance
+    change; the JSON store, whose journal is truncated on compaction, mirrors
+    every journal record here with `append`.
+    """
+
+    def __init__(self, conn, chat_id):
+        self.conn = conn
+        self.chat_id = chat_id
+
+    def insert(self, op, name, delta, balance, admin, ts=None):
+        """Adds one row without committing, for callers that own the surrounding transaction."""
+        self.conn.execute(
+            "INSERT INTO transactions (chat_id, ts, op, user, delta, balance, admin) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.chat_id, ts or time.time(), op, name, delta, balance, admin),
+        )
+
+    def append(self, record):
+        """Stores a `store.BalanceStore` journal record as history rows."""
+        op = record["op"]
+        try:
+            with self.conn:
+                if op == "batch":
+                    for entry in record["entries"]:
+                        self.insert(op, entry["user"], entry["delta"], entry["balance"], record["admin"], record["ts"])
+                elif op in ("credit_all", "undo_bulk"):
+                    self.insert(op, ALL_USERS, record["delta"], None, record["admin"], record["ts"])
+                else:
+                    self.insert(op, record["user"], record["delta"], record["balance"], record["admin"], record["ts"])
+        except sqlite3.Error as e:
+            logger.error(f"Error recording history: {e}")
+
+    def tail(self, name, limit=10):
+        """
+        The last `limit` changes to `name`, newest first, including the
+        ledger-wide credits made since the user was (last) added.
+        """
+        rows = self.conn.execute(
+            "SELECT id, ts, op, user, delta, balance, admin FROM transactions "
+            "WHERE chat_id = ? AND user = ? ORDER BY id DESC LIMIT ?",
+            (self.chat_id, name, limit),
+        ).fetchall()
+        rows += self.conn.execute(
+            "SELECT id, ts, op, user, delta, balance, admin FROM transactions "
+            "WHERE chat_id = ? AND user = ? AND id > ? ORDER BY id DESC LIMIT ?",
+            (self.chat_id, ALL_USERS, self._added_at(name), limit),
+        ).fetchall()
+        rows.sort(reverse=True)
+        return [dict(zip(COLUMNS, row[1:])) for row in rows[:limit]]
+
+    def range(self, start, end, name=None):
+        """
+        Yields the changes between the `start` and `end` timestamps in order,
+        reading them from the database as they are consumed. With `name`,
+        only that user's changes and the ledger-wide credits that reached them.
+        """
+        if name is None:
+            cursor = self.conn.execute(
+                "SELECT ts, op, user, delta, balance, admin FROM transactions "
+                "WHERE chat_id = ? AND ts >= ? AND ts < ? ORDER BY ts, id",
+                (self.chat_id, start, end),
+            )
+        else:
+            cursor = self.conn.execute(
+                "SELECT ts, op, user, delta, balance, admin FROM transactions "
+                "WHERE chat_id = ? AND ts >= ? AND ts < ? AND (user = ? OR (user = ? AND id > ?)) ORDER BY ts, id",
+                (self.chat_id, start, end, name, ALL_USERS, self._added_at(name)),
+            )
+        for row in cursor:
+            yield dict(zip(COLUMNS, row))
+
+    def _added_at(self, name):
+        row = self.conn.execute(
+            "SELECT MAX(id) FROM transactions WHERE chat_id = ? AND user = ? AND op = 'add_user'",
+            (self.chat_id, name),
+        ).fetchone()
+        # Users imported without an add_user record have been there all along.
+        return row[0] or 0
+
+
+async def write_statement(rows, f, fmt="csv", tz=None, yield_every=1000):
+    """
+    Writes `rows` (as yielded by `HistoryLog.range`) to the binary file `f` as
+    CSV or a JSON array, one row at a time, handing control back to the event
+    loop every `yield_every` rows. Returns the number of rows written.
+    """
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+    writer = csv.writer(text) if fmt == "csv" else None
+    if writer:
+        writer.writerow(["date", "operation", "user", "delta", "balance", "admin"])
+    else:
+        text.write("[")
+
+    count = 0
+    for row in rows:
+        date = datetime.datetime.fromtimestamp(row["ts"], tz).isoformat(timespec="seconds")
+        operation = OP_LABELS.get(row["op"], row["op"])
+        if writer:
+            writer.writerow([date, operation, row["user"], row["delta"], row["balance"], row["admin"]])
+        else:
+            text.write("," if count else "")
+            entry = {"date": date, "operation": operation, **{key: row[key] for key in COLUMNS[2:]}}
+            text.write("\n" + json.dumps(entry))
+        count += 1
+        if count % yield_every == 0:
+            await asyncio.sleep(0)
+
+    if not writer:
+        text.write("\n]\n")
+    text.flush()
+    # Leave `f` open for the caller, positioned at the start
+    text.detach()
+    f.seek(0)
+    return count
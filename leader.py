@@ -0,0 +1,101 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+class LeaderLease:
+    """
+    Elects one leader among bot replicas sharing a working directory (or a
+    shared volume) through a lease row in a small SQLite database. The leader
+    renews the lease well before it expires; if it dies or hangs for `ttl`
+    seconds, another replica takes the lease over. Releasing the lease on
+    shutdown lets a waiting replica take over immediately.
+
+    `try_acquire` and `release` block for up to `ttl / 3` seconds while
+    another replica holds the database lock, so the bot calls them from a
+    worker thread; they are serialized with each other.
+    """
+
+    def __init__(self, path, name="leader", ttl=15.0, owner=None):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        # The random part tells apart replicas with the same hostname and PID, e.g. PID 1 in containers.
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.held = False
+        self._expires = 0.0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            # isolation_level=None leaves transactions to the explicit BEGIN IMMEDIATE below.
+            self._conn = sqlite3.connect(self.path, timeout=self.ttl / 3, isolation_level=None, check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    @property
+    def is_leader(self):
+        # Checked against the local clock, so a leader that stalled past its lease stops acting as one.
+        return self.held and time.monotonic() < self._expires
+
+    def try_acquire(self):
+        """Takes the lease if it is free or expired, or renews it if already held. Returns whether it is held."""
+        with self._lock:
+            return self._try_acquire()
+
+    def _try_acquire(self):
+        started = time.monotonic()
+        now = time.time()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (self.name,)).fetchone()
+                if row is None or row[0] == self.owner or row[1] < now:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)",
+                        (self.name, self.owner, now + self.ttl),
+                    )
+                    self.held = True
+                    self._expires = started + self.ttl
+                else:
+                    self.held = False
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.error(f"Error renewing the leader lease: {e}")
+            # Whatever was held stays valid until it expires locally.
+            return self.is_leader
+        return self.held
+
+    def release(self):
+        with self._lock:
+            if not self.held:
+                return
+            try:
+                self.conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (self.name, self.owner))
+            except sqlite3.Error as e:
+                logger.error(f"Error releasing the leader lease: {e}")
+            self.held = False
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import logging
+from store import file_id, write_json_atomic
+from reports import BalanceReport
+
+logger = logging.getLogger(__name__)
+
+
+class Ledger:
+    """
+    The balances of one group together with its own currency, import amount,
+    payday and timezone, the ledger names linked to Telegram users and the
+    currencies some users prefer to see their balance in.
+    """
+
+    def __init__(
+        self, chat_id, store, currency, import_amount, payday_day, timezone=None, charges=(), aliases=None,
+        currencies=None, rates=None,
+    ):
+        self.chat_id = chat_id
+        self.store = store
+        self.currency = currency
+        self.import_amount = import_amount
+        self.payday_day = payday_day
+        self.timezone = timezone
+        self.charges = list(charges)
+        # Telegram user id (as a string, like every JSON key) -> ledger name
+        self.aliases = dict(aliases or {})
+        # Ledger name -> currency code its balance is also shown in
+        self.currencies = dict(currencies or {})
+        self.rates = rates
+        self.report = BalanceReport(store, currency, rates)
+        self.last_used = time.monotonic()
+
+    def settings(self):
+        return {
+            "currency": self.currency,
+            "import_amount": self.import_amount,
+            "payday_day": self.payday_day,
+            "timezone": self.timezone,
+            "charges": self.charges,
+            "aliases": self.aliases,
+            "currencies": self.currencies,
+        }
+
+
+class LedgerRegistry:
+    """
+    Serves one ledger per group chat from a single process. Ledgers are keyed
+    by chat id and opened lazily from the storage `backend` on first use;
+    ledgers idle for longer than `max_idle` seconds are closed and unloaded by
+    `evict_idle`. Per-group settings that differ from the defaults are stored
+    in `settings_path`. Every ledger converts currencies with the shared
+    `rates` table.
+
+    On a follower replica the registry is `read_only`: ledgers are opened
+    without writing to storage and `refresh` picks up the leader's changes
+    until `promote` makes this replica the writer.
+    """
+
+    def __init__(self, backend, defaults, settings_path="groups.json", max_idle=60 * 60, rates=None):
+        self.backend = backend
+        self.defaults = defaults
+        self.rates = rates
+        self.settings_path = settings_path
+        self.max_idle = max_idle
+        self._settings = {}
+        self._settings_id = None
+        self._ledgers = {}
+        self.read_only = False
+
+    # --- Settings ---
+
+    def load_settings(self):
+        try:
+            if os.path.exists(self.settings_path):
+                with open(self.settings_path, "r") as f:
+                    self._settings_id = file_id(os.fstat(f.fileno()))
+                    self._settings = {int(k): v for k, v in json.load(f).items()}
+        except (json.JSONDecodeError, IOError, ValueError) as e:
+            logger.error(f"Error loading group settings: {e}")
+            self._settings = {}
+
+    def settings(self, chat_id):
+        return {**self.defaults, **self._settings.get(chat_id, {})}
+
+    def configure(self, chat_id, **settings):
+        """Updates the settings of a group, persists them and applies them to the open ledger."""
+        self._settings.setdefault(chat_id, {}).update(settings)
+        write_json_atomic(self.settings_path, {str(k): v for k, v in self._settings.items()})
+        ledger = self._ledgers.get(chat_id)
+        if ledger is not None:
+            self._apply_settings(ledger, settings)
+
+    def _apply_settings(self, ledger, settings):
+        for key, value in settings.items():
+            setattr(ledger, key, value)
+        ledger.report = BalanceReport(ledger.store, ledger.currency, ledger.rates)
+
+    def chat_ids(self):
+        """Every group that has a stored ledger or custom settings."""
+        return sorted(self.backend.chat_ids() | set(self._settings))
+
+    # --- Ledgers ---
+
+    def get(self, chat_id):
+        """Returns the ledger of `chat_id`, opening it on first use."""
+        ledger = self._ledgers.get(chat_id)
+        if ledger is None:
+            store = self.backend.open(chat_id, read_only=self.read_only)
+            ledger = Ledger(chat_id, store, rates=self.rates, **self.settings(chat_id))
+            self._ledgers[chat_id] = ledger
+        ledger.last_used = time.monotonic()
+        return ledger
+
+    def loaded(self):
+        return list(self._ledgers.values())
+
+    # --- Replication ---
+
+    def refresh(self):
+        """Catches up with the settings and ledgers written by the leader replica."""
+        self._refresh_settings()
+        for ledger in self._ledgers.values():
+            ledger.store.refresh()
+
+    def _refresh_settings(self):
+        current = file_id(os.stat(self.settings_path)) if os.path.exists(self.settings_path) else None
+        if current != self._settings_id:
+            self.load_settings()
+            for chat_id, ledger in self._ledgers.items():
+                self._apply_settings(ledger, self.settings(chat_id))
+
+    def promote(self):
+        """Makes this replica the writer, after catching up with everything the previous leader wrote."""
+        self._refresh_settings()
+        self.read_only = False
+        for ledger in self._ledgers.values():
+            # A full reload also repairs a journal record the previous leader was writing when it died.
+            ledger.store.read_only = False
+            ledger.store.load()
+
+    def demote(self):
+        """Stops writing to storage, including the final flush on close."""
+        self.read_only = True
+        for ledger in self._ledgers.values():
+            ledger.store.read_only = True
+
+    async def evict_idle(self):
+        """Closes and unloads ledgers that have not been used for `max_idle` seconds."""
+        cutoff = time.monotonic() - self.max_idle
+        for chat_id, ledger in list(self._ledgers.items()):
+            if ledger.last_used < cutoff:
+                del self._ledgers[chat_id]
+                await ledger.store.close()
+                logger.info(f"Unloaded idle ledger of chat {chat_id}.")
+
+    async def close(self):
+        for ledger in self._ledgers.values():
+            await ledger.store.close()
+        self._ledgers.clear()
+        self.backend.close()
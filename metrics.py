@@ -0,0 +1,138 @@
+import time
+import asyncio
+import bisect
+import logging
+import functools
+
+logger = logging.getLogger(__name__)
+
+# Latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (inf if it's past the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    A minimal in-process metrics registry: counters, latency histograms and
+    gauges computed on demand, keyed by name and labels, rendered in the
+    Prometheus text format.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name, callback):
+        """Registers `callback` to compute the value of `name` at render time."""
+        self.gauges[name] = callback
+
+    def timed(self, name, **labels):
+        """
+        Decorates a sync or async function to record its latency in the `name`
+        histogram, and failures in the `<name>_errors` counter.
+        """
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapped(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    except BaseException:
+                        self.inc(f"{name}_errors", **labels)
+                        raise
+                    finally:
+                        self.observe(name, time.perf_counter() - start, **labels)
+                return async_wrapped
+
+            @functools.wraps(func)
+            def wrapped(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except BaseException:
+                    self.inc(f"{name}_errors", **labels)
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return wrapped
+        return decorator
+
+    def render(self):
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}_total{_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_seconds_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_seconds_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_seconds_count{_labels(labels)} {histogram.count}")
+        for name, callback in sorted(self.gauges.items()):
+            try:
+                lines.append(f"{name} {callback()}")
+            except Exception as e:
+                logger.error(f"Error computing gauge {name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+# Shared registry used by the bot's modules
+metrics = Metrics()
+
+
+async def serve_metrics(listen, port):
+    """Exposes the registry on http://<listen>:<port>/metrics; returns the runner to clean up."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    await web.TCPSite(runner, listen, port).start()
+    logger.info(f"Serving metrics on http://{listen}:{port}/metrics")
+    return runner
@@ -0,0 +1,73 @@
+"""
+Imports existing JSON ledgers into the SQLite database used with STORAGE=sqlite.
+
+Usage:
+    python migrate.py <group_id> [--balances balances.json] [--ledgers ledgers] [--history history.db] [--database balances.db] [--force]
+
+The default group's ledger is read from the balances file, every other group's
+from `<ledgers>/<chat_id>.json`; pending journal records are replayed first.
+The last monthly credit comes along so `/undo_payday` still works, and so does
+the transaction history kept alongside the JSON ledgers.
+
+Groups that already have balances (or history) in the database are skipped,
+so running the migration again never overwrites what the bot has written to
+SQLite since; `--force` imports the balances of such groups anyway, replacing
+those of the users in the JSON ledger. The JSON files are only read.
+"""
+import os
+import argparse
+import logging
+from store import JsonBackend
+from sqlite_store import SqliteBackend
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def migrate(group_id, balances_file, ledgers_dir, database_file, history_file="history.db", force=False):
+    source = JsonBackend(group_id, balances_file, directory=ledgers_dir)
+    target = SqliteBackend(database_file)
+    try:
+        existing = target.chat_ids()
+        for chat_id in sorted(source.chat_ids()):
+            if chat_id in existing and not force:
+                logger.info(f"Chat {chat_id} already has balances in {database_file}, skipping it (use --force to overwrite).")
+                continue
+            # Read-only, so the source ledgers are left exactly as they are
+            store = source.open(chat_id, read_only=True)
+            balances = dict(store.items())
+            target.open(chat_id).import_balances(balances, last_bulk=store.last_bulk())
+            logger.info(f"Imported {len(balances)} balances for chat {chat_id}.")
+        if os.path.exists(history_file):
+            target.conn.execute("ATTACH DATABASE ? AS json_history", (history_file,))
+            try:
+                migrated = {chat_id for chat_id, in target.conn.execute("SELECT DISTINCT chat_id FROM main.transactions")}
+                for chat_id in sorted(migrated):
+                    logger.info(f"Chat {chat_id} already has history in {database_file}, not copying it again.")
+                with target.conn:
+                    copied = target.conn.execute(
+                        "INSERT INTO main.transactions (chat_id, ts, op, user, delta, balance, admin) "
+                        "SELECT chat_id, ts, op, user, delta, balance, admin FROM json_history.transactions "
+                        "WHERE chat_id NOT IN (SELECT DISTINCT chat_id FROM main.transactions) ORDER BY id"
+                    ).rowcount
+            finally:
+                target.conn.execute("DETACH DATABASE json_history")
+            logger.info(f"Imported {copied} history records.")
+    finally:
+        target.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import JSON ledgers into SQLite.")
+    parser.add_argument("group_id", type=int, help="GROUP_ID the balances file belongs to")
+    parser.add_argument("--balances", default="balances.json")
+    parser.add_argument("--ledgers", default="ledgers")
+    parser.add_argument("--history", default="history.db")
+    parser.add_argument("--database", default="balances.db")
+    parser.add_argument("--force", action="store_true", help="import balances even for groups already in the database")
+    args = parser.parse_args()
+    migrate(args.group_id, args.balances, args.ledgers, args.database, args.history, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import asyncio
+import difflib
+import itertools
+import unicodedata
+
+# Trigram postings longer than this (e.g. the "use" in user1..user100000) are
+# only used to find candidates when the query has nothing rarer to go on.
+MAX_CANDIDATES = 500
+
+# How many names get their trigrams indexed between two yields to the event loop
+INDEX_STEP = 1000
+
+
+def normalize(name):
+    """The form names are matched on: "@Bob", "bob" and "ＢＯＢ" all normalize to "bob"."""
+    if name.isascii():
+        # NFKC leaves ASCII alone and casefold() is lower() on it, at a fraction of the cost.
+        return name.lower().lstrip("@")
+    return unicodedata.normalize("NFKC", name).casefold().lstrip("@")
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Resolves user input to the ledger's spelling of a name. Exact lookups go
+    through a dict of normalized names; "did you mean" suggestions are ranked
+    by the trigrams they share with the input. Both structures are updated
+    incrementally as users are added and removed.
+
+    Only the dict is built up front. Indexing the trigrams of a large ledger
+    takes seconds, so the names passed in are indexed by `index_step`, a few
+    at a time (see `build_in_background`); until then suggestions only come
+    from the names indexed so far.
+    """
+
+    def __init__(self, names=()):
+        self._names = {normalize(name): name for name in names}
+        self._postings = {}
+        # Keys whose trigrams are not indexed yet
+        self._pending = list(self._names)
+        self._task = None
+
+    def add(self, name):
+        key = normalize(name)
+        self._names[key] = name
+        self._index(key)
+
+    def _index(self, key):
+        for gram in trigrams(key):
+            self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, name):
+        key = normalize(name)
+        if self._names.get(key) != name:
+            return
+        del self._names[key]
+        for gram in trigrams(key):
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def sync(self, names):
+        """Brings the index in line with `names`, touching only the names added or removed since it was built."""
+        names = set(names)
+        current = set(self._names.values())
+        for name in current - names:
+            self.remove(name)
+        for name in names - current:
+            self.add(name)
+
+    def index_step(self, count=INDEX_STEP):
+        """Indexes the trigrams of up to `count` pending names; returns whether any are left."""
+        pending = self._pending
+        for _ in range(min(count, len(pending))):
+            key = pending.pop()
+            # Skipped if removed meanwhile; names added meanwhile were indexed by `add`.
+            if key in self._names:
+                self._index(key)
+        return bool(pending)
+
+    def build_in_background(self):
+        """Indexes the pending trigrams a step at a time on the running event loop, or all at once without one."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            while self.index_step():
+                pass
+            return
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._index_pending())
+
+    async def _index_pending(self):
+        while self.index_step():
+            await asyncio.sleep(0)
+
+    def __len__(self):
+        return len(self._names)
+
+    def resolve(self, name):
+        """Returns the stored name matching `name` regardless of case, or None."""
+        return self._names.get(normalize(name))
+
+    def suggest(self, name, limit=3, cutoff=0.6):
+        """Returns up to `limit` stored names that look like `name`, best first."""
+        key = normalize(name)
+        grams = trigrams(key)
+        postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+
+        # Candidates come from the rarest trigrams first, so a query never walks a
+        # posting list that covers most of the ledger; only they are compared in full.
+        candidates = set()
+        for keys in postings:
+            if len(candidates) + len(keys) > MAX_CANDIDATES:
+                if not candidates:
+                    candidates.update(itertools.islice(keys, MAX_CANDIDATES))
+                break
+            candidates.update(keys)
+
+        scored = []
+        for candidate in candidates:
+            score = difflib.SequenceMatcher(None, key, candidate).ratio()
+            if candidate.startswith(key):
+                score = max(score, cutoff)
+            if score >= cutoff:
+                scored.append((-score, candidate))
+        scored.sort()
+        return [self._names[candidate] for _, candidate in scored[:limit]]
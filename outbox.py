@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import datetime
+import logging
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+from store import write_json_atomic
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_ENDPOINTS = ("send", "edit", "copy", "forward")
+
+
+def retry_after_seconds(error):
+    """RetryAfter.retry_after is an int or a timedelta depending on the library version."""
+    value = error.retry_after
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        # The lock makes waiters queue up in order instead of racing for each new token.
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class TokenBucketRateLimiter(BaseRateLimiter):
+    """
+    Rate limits every Bot API request with a global token bucket and one bucket
+    per chat, sized to Telegram's flood limits (about 30 messages per second
+    overall, 1 per second in a private chat and 20 per minute in a group).
+    Requests that still hit a RetryAfter wait the requested time and are
+    retried up to `max_retries` times.
+    """
+
+    def __init__(self, global_rate=30, private_rate=1, group_rate=20 / 60, max_retries=3):
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                # Buckets that have refilled completely carry no state worth keeping.
+                self._chats = {k: b for k, b in self._chats.items() if not b.is_full()}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.private_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, 20 if is_group else 3)
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # Per-chat limits only apply to messages, not to lookups like getChatAdministrators.
+        chat_id = data.get("chat_id") if endpoint.startswith(MESSAGE_ENDPOINTS) else None
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        attempt = 0
+        while True:
+            await self._global.acquire()
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                delay = retry_after_seconds(e)
+                logger.warning(f"Flood limit hit on {endpoint}, retrying in {delay}s ({attempt}/{max_retries}).")
+                metrics.inc("telegram_retry_after", endpoint=endpoint)
+                await asyncio.sleep(delay)
+            finally:
+                metrics.observe("telegram_api", time.perf_counter() - start, endpoint=endpoint)
+
+
+class Outbox:
+    """
+    Delivers broadcast messages (e.g. the monthly report) in the background.
+    Messages are written to `path` when queued and removed only once Telegram
+    accepts them, so reports that could not be delivered are retried with
+    exponential backoff, including after a restart.
+    """
+
+    def __init__(self, path, max_backoff=15 * 60):
+        self.path = path
+        self.max_backoff = max_backoff
+        self._pending = []
+        self._wakeup = None
+        self._task = None
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    self._pending = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"Error loading outbox: {e}")
+            self._pending = []
+        if self._pending:
+            logger.info(f"{len(self._pending)} undelivered messages will be retried.")
+
+    def __len__(self):
+        return len(self._pending)
+
+    def enqueue(self, chat_id, text, parse_mode=None):
+        self.enqueue_many(chat_id, [text], parse_mode)
+
+    def enqueue_many(self, chat_id, texts, parse_mode=None):
+        """Queues several messages with a single write of the outbox file."""
+        for text in texts:
+            self._pending.append({"id": uuid.uuid4().hex, "chat_id": chat_id, "text": text, "parse_mode": parse_mode})
+        self._save()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _save(self):
+        write_json_atomic(self.path, self._pending)
+
+    def start(self, bot):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._deliver(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _deliver(self, bot):
+        backoff = 1
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            message = self._pending[0]
+            try:
+                await bot.send_message(chat_id=message["chat_id"], text=message["text"], parse_mode=message["parse_mode"])
+            except (BadRequest, Forbidden) as e:
+                # Retrying won't help (bot removed from the group, malformed text...).
+                logger.error(f"Dropping message to chat {message['chat_id']}: {e}")
+            except TelegramError as e:
+                logger.warning(f"Failed to deliver message to chat {message['chat_id']}, retrying in {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = 1
+            self._pending = [m for m in self._pending if m["id"] != message["id"]]
+            self._save()
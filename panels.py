@@ -0,0 +1,88 @@
+import hashlib
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import InlineKeyboardButtonLimit
+
+# Callback data prefix of the admin panel buttons:
+#   "pnl:p:<page>"                   show a page of users
+#   "pnl:u:<page>:<key>"             show the amount buttons of a user
+#   "pnl:a:<cents>:<page>:<key>"     add (or subtract) an amount to a user
+PANEL_PREFIX = "pnl"
+PANEL_PAGE_SIZE = 24
+PANEL_COLUMNS = 3
+
+# The amounts offered for every user, added and subtracted
+PRESET_AMOUNTS = (1, 5, 10)
+
+CALLBACK_DATA_LIMIT = InlineKeyboardButtonLimit.MAX_CALLBACK_DATA
+
+
+def name_key(name, room):
+    """
+    How a name is written in callback data: the name itself when it fits in
+    `room` bytes, otherwise a short hash that `find_name` maps back to it.
+    """
+    if len(name.encode()) <= room and not name.startswith("#"):
+        return name
+    return "#" + hashlib.blake2b(name.encode(), digest_size=8).hexdigest()
+
+
+def find_name(store, key):
+    if not key.startswith("#"):
+        return key if key in store else None
+    # Only names too long for callback data get here, so scanning is rare.
+    for name in store.names():
+        if name_key(name, 0) == key:
+            return name
+    return None
+
+
+def callback_data(*parts):
+    """Joins `parts` after the prefix; the last part is a name, shortened to fit if needed."""
+    head = ":".join([PANEL_PREFIX, *map(str, parts[:-1])]) + ":"
+    return head + name_key(parts[-1], CALLBACK_DATA_LIMIT - len(head.encode()))
+
+
+def parse_callback(data):
+    """Returns (action, args) from panel callback data, e.g. ("a", ["500", "0", "Bob"])."""
+    _, action, rest = data.split(":", 2)
+    # The name comes last and may itself contain ":"
+    splits = {"p": 0, "u": 1, "a": 2}.get(action, 0)
+    return action, rest.split(":", splits)
+
+
+def users_keyboard(items, page):
+    """
+    The user picker for a list of (name, balance) pairs: a grid of names with
+    their balances, and ◀️/▶️ buttons when they don't fit on one page.
+    Returns the keyboard, the page shown and the number of pages.
+    """
+    pages = max(1, -(-len(items) // PANEL_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    start = page * PANEL_PAGE_SIZE
+    buttons = [
+        InlineKeyboardButton(f"{name}: {balance}", callback_data=callback_data("u", page, name))
+        for name, balance in items[start:start + PANEL_PAGE_SIZE]
+    ]
+    rows = [buttons[i:i + PANEL_COLUMNS] for i in range(0, len(buttons), PANEL_COLUMNS)]
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"{PANEL_PREFIX}:p:{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"{PANEL_PREFIX}:p:{page + 1}"))
+    if navigation:
+        rows.append(navigation)
+    return InlineKeyboardMarkup(rows), page, pages
+
+
+def amounts_keyboard(name, page, currency):
+    """The preset amounts for one user, and a button back to the page of users it was picked from."""
+    rows = [
+        [
+            InlineKeyboardButton(f"{sign * amount:+} {currency}", callback_data=callback_data("a", sign * amount * 100, page, name))
+            for amount in PRESET_AMOUNTS
+        ]
+        for sign in (1, -1)
+    ]
+    rows.append([InlineKeyboardButton("⬅️ Users", callback_data=f"{PANEL_PREFIX}:p:{page}")])
+    return InlineKeyboardMarkup(rows)
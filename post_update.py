@@ -0,0 +1,48 @@
+"""
+Local stand-in for Telegram when running in webhook mode: POSTs an Update to
+the bot's webhook server, e.g.
+
+    python post_update.py "/balance Bob" --chat-id -1001234567890 --user-id 42
+
+Replies are sent through the real Bot API, so a valid token is still needed to
+see them; the server's response status shows whether the update was accepted.
+"""
+import json
+import time
+import argparse
+import urllib.request
+
+
+def make_update(text, chat_id, user_id, update_id):
+    command = text.split()[0] if text.startswith("/") else None
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+        "text": text,
+    }
+    if command:
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST a fake Telegram update to the webhook server.")
+    parser.add_argument("text")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--chat-id", type=int, default=1)
+    parser.add_argument("--user-id", type=int, default=1)
+    args = parser.parse_args()
+
+    body = json.dumps(make_update(args.text, args.chat_id, args.user_id, int(time.time()))).encode()
+    request = urllib.request.Request(args.url, data=body, headers={"Content-Type": "application/json"})
+    if args.secret:
+        request.add_header("X-Telegram-Bot-Api-Secret-Token", args.secret)
+    with urllib.request.urlopen(request) as response:
+        print(response.status)
+
+
+if __name__ == "__main__":
+    main()
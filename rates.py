@@ -0,0 +1,95 @@
+import os
+import json
+import logging
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+from store import file_id
+
+logger = logging.getLogger(__name__)
+
+
+class RateTable:
+    """
+    Exchange rates read from a local JSON file, so conversions never wait on
+    the network:
+
+        {"base": "EUR", "rates": {"EUR": 1, "USD": "1.0842", "GBP": "0.8521"},
+         "aliases": {"€": "EUR", "$": "USD"}}
+
+    Each rate is the amount of a currency that one unit of `base` buys, kept
+    as a Decimal. `refresh` reloads the file when it has been replaced and
+    bumps `version`; conversion factors are memoized until then, and callers
+    can key their own caches on `version` too. Amounts are converted in
+    integer minor units (cents), every currency having two decimals like the
+    ledger itself.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self.base = None
+        self._rates = {}
+        self._aliases = {}
+        self._file_id = None
+        self._factors = {}
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                current = file_id(os.fstat(f.fileno()))
+                data = json.load(f)
+            rates = {code.upper(): Decimal(str(rate)) for code, rate in data["rates"].items()}
+            if any(rate <= 0 for rate in rates.values()):
+                raise ValueError("rates must be positive")
+            aliases = {alias: code.upper() for alias, code in data.get("aliases", {}).items()}
+            base = data.get("base")
+        except FileNotFoundError:
+            current, rates, aliases, base = None, {}, {}, None
+        except (ValueError, KeyError, TypeError, AttributeError, InvalidOperation, OSError) as e:
+            # Keep converting with the rates we had rather than with none.
+            logger.error(f"Error loading exchange rates from {self.path}: {e}")
+            return
+
+        self._file_id = current
+        self._rates = rates
+        self._aliases = aliases
+        self.base = base
+        self._factors = {}
+        self.version += 1
+        logger.info(f"Loaded {len(rates)} exchange rates (version {self.version}).")
+
+    def refresh(self):
+        """Reloads the table if the file was replaced, added or removed since it was read."""
+        current = file_id(os.stat(self.path)) if os.path.exists(self.path) else None
+        if current != self._file_id:
+            self.load()
+
+    def __len__(self):
+        return len(self._rates)
+
+    def items(self):
+        return sorted(self._rates.items())
+
+    def code(self, currency):
+        """Returns the rate table's code for `currency` (a code in any case, or an alias such as "€"), or None."""
+        if currency is None:
+            return None
+        code = self._aliases.get(currency, currency.upper())
+        return code if code in self._rates else None
+
+    def factor(self, source, target):
+        """How many units of `target` one unit of `source` is worth, or None if either has no rate."""
+        key = (source, target)
+        factor = self._factors.get(key)
+        if factor is None:
+            source_code, target_code = self.code(source), self.code(target)
+            if source_code is None or target_code is None:
+                return None
+            factor = self._factors[key] = self._rates[target_code] / self._rates[source_code]
+        return factor
+
+    def convert(self, cents, source, target):
+        """Converts an amount in minor units from `source` to `target`, rounding half to even; None without rates."""
+        factor = self.factor(source, target)
+        if factor is None:
+            return None
+        return int((cents * factor).quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
@@ -0,0 +1,208 @@
+from collections import OrderedDict
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import MessageLimit
+from metrics import metrics
+from store import from_cents, to_cents
+
+MESSAGE_LIMIT = MessageLimit.MAX_TEXT_LENGTH
+PAGE_SIZE = 50
+
+# Callback data prefix of the pagination buttons: "bal:<filter>:<sort>:<page>[:<currency>]"
+CALLBACK_PREFIX = "bal"
+
+FILTERS = {
+    "all": None,
+    "negative": lambda balance: balance < 0,
+    "positive": lambda balance: balance > 0,
+}
+
+SORTS = {
+    "name": (lambda item: item[0].lower(), False),
+    "asc": (lambda item: item[1], False),
+    "desc": (lambda item: item[1], True),
+}
+
+
+def chunk_lines(lines, limit=MESSAGE_LIMIT):
+    """
+    Joins `lines` into newline-separated chunks of at most `limit` characters,
+    yielding each chunk as soon as it is full.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        line = line[:limit]
+        extra = len(line) + (1 if chunk else 0)
+        if chunk and size + extra > limit:
+            yield "\n".join(chunk)
+            chunk = []
+            extra = len(line)
+            size = 0
+        chunk.append(line)
+        size += extra
+    if chunk:
+        yield "\n".join(chunk)
+
+
+def parse_view(args):
+    """Picks a filter and a sort order out of command arguments, e.g. `negative desc`."""
+    filter_name, sort_name = "all", "name"
+    for arg in args:
+        arg = arg.lower()
+        if arg in FILTERS:
+            filter_name = arg
+        elif arg in SORTS:
+            sort_name = arg
+    return filter_name, sort_name
+
+
+class LRUCache:
+    """A mapping that keeps at most `maxsize` entries, evicting the least recently used."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        metrics.inc("render_cache", result="miss" if value is None else "hit")
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._data)
+
+
+class BalanceReport:
+    """
+    Renders paginated, filtered and sorted views of the ledger. Everything it
+    renders is cached under the ledger version it was rendered from, so
+    repeated requests are served without touching the ledger until the next
+    change bumps the version; entries of older versions are evicted as least
+    recently used. Per-user lines are also kept across versions as long as
+    the user's balance is unchanged, so a change re-renders only its own line.
+
+    With a `rates` table, views can be shown in another currency: they are
+    converted from the cached view in the ledger's currency and cached under
+    the rate table version as well.
+    """
+
+    def __init__(self, store, currency, rates=None, page_size=PAGE_SIZE, max_pages=256, max_views=8):
+        self.store = store
+        self.currency = currency
+        self.rates = rates
+        self.page_size = page_size
+        # Views and line lists hold one entry per user, so only a few are kept.
+        self._views = LRUCache(max_views)
+        self._lines = LRUCache(max_views)
+        self._pages = LRUCache(max_pages)
+        self._totals = LRUCache(max_views)
+        # name -> (balance, rendered line)
+        self._user_lines = {}
+
+    def view(self, filter_name="all", sort_name="name", currency=None):
+        """Returns the (name, balance) pairs selected by the filter, in sort order."""
+        if currency is not None:
+            return self._converted_view(filter_name, sort_name, currency)
+        key = (self.store.version, filter_name, sort_name)
+        items = self._views.get(key)
+        if items is None:
+            predicate = FILTERS[filter_name]
+            items = [(n, b) for n, b in self.store.items() if predicate is None or predicate(b)]
+            sort_key, reverse = SORTS[sort_name]
+            items.sort(key=sort_key, reverse=reverse)
+            self._views.put(key, items)
+        return items
+
+    def _converted_view(self, filter_name, sort_name, currency):
+        # Rates are positive, so converting keeps both the filter and the order.
+        key = (self.store.version, self.rates.version, filter_name, sort_name, currency)
+        items = self._views.get(key)
+        if items is None:
+            convert = self.rates.convert
+            items = self._views.put(key, [
+                (name, from_cents(convert(to_cents(balance), self.currency, currency)))
+                for name, balance in self.view(filter_name, sort_name)
+            ])
+        return items
+
+    def total(self, filter_name="all", currency=None):
+        """The sum of the balances in a view, in the ledger's currency or converted to `currency`."""
+        key = (self.store.version, filter_name)
+        cents = self._totals.get(key)
+        if cents is None:
+            cents = self._totals.put(key, sum(to_cents(balance) for _, balance in self.view(filter_name, "name")))
+        # Converted from the exact total rather than summed from rounded lines
+        if currency is not None:
+            cents = self.rates.convert(cents, self.currency, currency)
+        return from_cents(cents)
+
+    def user_line(self, name, balance, currency=None):
+        if currency is not None:
+            return f"👤 {name}: {balance} {currency}"
+        cached = self._user_lines.get(name)
+        if cached is not None and cached[0] == balance:
+            return cached[1]
+        line = f"👤 {name}: {balance} {self.currency}"
+        self._user_lines[name] = (balance, line)
+        return line
+
+    def lines(self, filter_name="all", sort_name="name"):
+        """Returns the rendered line of every user in a view, e.g. for the full monthly report."""
+        key = (self.store.version, filter_name, sort_name)
+        lines = self._lines.get(key)
+        if lines is None:
+            view = self.view(filter_name, sort_name)
+            if len(self._user_lines) > 2 * len(view) + 1000:
+                # Drop the lines of removed users
+                self._user_lines = {}
+            lines = self._lines.put(key, [self.user_line(name, balance) for name, balance in view])
+        return lines
+
+    def page_count(self, filter_name="all", sort_name="name"):
+        return max(1, -(-len(self.view(filter_name, sort_name)) // self.page_size))
+
+    def page(self, filter_name="all", sort_name="name", page=0, currency=None):
+        """Returns the text and pagination keyboard (or None) of one page, optionally converted to `currency`."""
+        pages = self.page_count(filter_name, sort_name)
+        page = min(max(page, 0), pages - 1)
+        key = (self.store.version, filter_name, sort_name, page)
+        if currency is not None:
+            key += (self.rates.version, currency)
+        rendered = self._pages.get(key)
+        if rendered is None:
+            rendered = self._pages.put(key, self._render(filter_name, sort_name, page, pages, currency))
+        return rendered
+
+    def _render(self, filter_name, sort_name, page, pages, currency):
+        start = page * self.page_size
+        items = self.view(filter_name, sort_name, currency)[start:start + self.page_size]
+
+        title = "📊 **Current Balances:**"
+        if filter_name != "all":
+            title += f" ({filter_name})"
+        if currency is not None:
+            title += f" in {currency}"
+        if pages > 1:
+            title += f" — page {page + 1}/{pages}"
+        lines = [title] + [self.user_line(name, balance, currency) for name, balance in items]
+        lines.append(f"Σ Total: {self.total(filter_name, currency)} {currency or self.currency}")
+        text = next(chunk_lines(lines))
+
+        if pages == 1:
+            return text, None
+        suffix = f":{currency}" if currency is not None else ""
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton("◀️", callback_data=f"{CALLBACK_PREFIX}:{filter_name}:{sort_name}:{page - 1}{suffix}"))
+        if page < pages - 1:
+            buttons.append(InlineKeyboardButton("▶️", callback_data=f"{CALLBACK_PREFIX}:{filter_name}:{sort_name}:{page + 1}{suffix}"))
+        return text, InlineKeyboardMarkup([buttons])
@@ -0,0 +1,129 @@
+import os
+import json
+import calendar
+import datetime
+import logging
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from store import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHARGE = "subscription"
+
+
+def charges_of(settings):
+    """
+    The recurring charges of a group: the monthly import on the payday, plus
+    any extra charges added with /add_charge.
+    """
+    default = {"name": DEFAULT_CHARGE, "amount": settings["import_amount"], "day": settings["payday_day"]}
+    return [default] + settings.get("charges", [])
+
+
+def get_timezone(name):
+    """
+    Returns the zone called `name`, or None for the server's local time when
+    it is empty. None rather than today's local offset, so every date and
+    fire time is resolved with the offset in effect at that moment (DST).
+    """
+    if name:
+        return ZoneInfo(name)
+    return None
+
+
+def is_valid_timezone(name):
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def fire_time(year, month, day, hour, tz):
+    """
+    When a charge for `day` fires in the given month; days past the month's
+    end fire on its last day. Without `tz`, at that hour in server local time.
+    """
+    day = min(day, calendar.monthrange(year, month)[1])
+    if tz is None:
+        return datetime.datetime(year, month, day, hour).astimezone()
+    return datetime.datetime(year, month, day, hour, tzinfo=tz)
+
+
+def period_of(year, month):
+    return f"{year:04d}-{month:02d}"
+
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _previous_month(year, month):
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+class PaydayScheduler:
+    """
+    Computes the exact fire times of recurring monthly charges and remembers
+    the last period ("YYYY-MM") applied for each group and charge in `path`,
+    so a restart never applies a period twice and periods missed while the
+    bot was down are caught up at the next check.
+    """
+
+    def __init__(self, path, hour=8):
+        self.path = path
+        self.hour = hour
+        self._applied = {}
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    self._applied = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"Error loading payday schedule: {e}")
+            self._applied = {}
+
+    def _key(self, chat_id, charge):
+        return f"{chat_id}:{charge['name']}"
+
+    def last_fire(self, charge, tz, now):
+        """The most recent fire time of `charge` at or before `now`."""
+        local = now.astimezone(tz)
+        year, month = local.year, local.month
+        fire = fire_time(year, month, charge["day"], self.hour, tz)
+        if fire > local:
+            year, month = _previous_month(year, month)
+            fire = fire_time(year, month, charge["day"], self.hour, tz)
+        return fire
+
+    def next_fire(self, charge, tz, now):
+        """The first fire time of `charge` after `now`."""
+        last = self.last_fire(charge, tz, now)
+        year, month = _next_month(last.year, last.month)
+        return fire_time(year, month, charge["day"], self.hour, tz)
+
+    def due(self, chat_id, charge, tz, now):
+        """
+        Returns the periods of `charge` that have fired but were not applied
+        yet, oldest first. A charge seen for the first time starts counting
+        from its latest fire time, so adding a charge never back-fills it.
+        """
+        last = self.last_fire(charge, tz, now)
+        key = self._key(chat_id, charge)
+        applied = self._applied.get(key)
+        if applied is None:
+            self.mark(chat_id, charge, period_of(last.year, last.month))
+            return []
+
+        periods = []
+        year, month = map(int, applied.split("-"))
+        while (year, month) < (last.year, last.month):
+            year, month = _next_month(year, month)
+            periods.append(period_of(year, month))
+        return periods
+
+    def mark(self, chat_id, charge, period):
+        """Records `period` as applied; must be called right after applying it, without awaiting in between."""
+        self._applied[self._key(chat_id, charge)] = period
+        write_json_atomic(self.path, self._applied)
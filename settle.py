@@ -0,0 +1,62 @@
+import heapq
+from store import to_cents, from_cents
+
+
+def plan_transfers(balances):
+    """
+    Computes the transfers that settle a ledger: a list of (debtor, creditor,
+    amount) where the debtor (negative balance) pays the creditor (positive
+    balance). Returns the transfers, largest first, and the amount that stays
+    on the ledger because the balances don't add up to zero.
+
+    Debts and credits of the same size are paired first, then the largest
+    debt is repeatedly matched with the largest credit through two heaps, so
+    each transfer zeroes at least one balance: at most n - 1 transfers for n
+    non-zero balances, in O(n log n). (Finding the true minimum is NP-hard;
+    this greedy plan is what people settle up with in practice.)
+    """
+    credits = []
+    debts = {}
+    for name, balance in balances:
+        cents = to_cents(balance)
+        if cents > 0:
+            credits.append((-cents, name))
+        elif cents < 0:
+            debts.setdefault(-cents, []).append(name)
+
+    transfers = []
+    unmatched = []
+    for cents, creditor in credits:
+        debtors = debts.get(-cents)
+        if debtors:
+            transfers.append((-cents, debtors.pop(), creditor))
+        else:
+            unmatched.append((cents, creditor))
+
+    # Both heaps hold (-cents, name), so the largest amount is popped first.
+    creditors = unmatched
+    debtors = [(-cents, name) for cents, names in debts.items() for name in names]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((amount, debtor, creditor))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        elif -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+
+    remainder = -sum(cents for cents, _ in creditors) + sum(cents for cents, _ in debtors)
+    transfers.sort(key=lambda transfer: (-transfer[0], transfer[1], transfer[2]))
+    return [(debtor, creditor, from_cents(cents)) for cents, debtor, creditor in transfers], from_cents(remainder)
+
+
+def transfer_changes(transfers):
+    """The (name, delta) changes that apply `transfers` with `apply_batch`."""
+    changes = []
+    for debtor, creditor, amount in transfers:
+        changes.append((debtor, amount))
+        changes.append((creditor, -amount))
+    return changes
@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import contextlib
+from urllib.parse import quote
+from store import LockTable, StorageError, from_cents, to_cents
+from metrics import metrics
+from names import NameIndex
+from history import TRANSACTIONS_SCHEMA, HistoryLog
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS balances (
+    chat_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    cents INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, name)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS bulk_operations (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    delta REAL NOT NULL,
+    note TEXT,
+    names TEXT NOT NULL,
+    undone INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS bulk_operations_by_chat ON bulk_operations (chat_id, id);
+"""
+
+
+class SqliteBalanceStore:
+    """
+    SQLite implementation of the ledger storage interface (see
+    `store.BalanceStore`). Lookups are primary-key point queries on
+    (chat_id, name) and every mutation is a single-row write plus its
+    transaction record, committed together.
+
+    Reads always see what other processes committed, so a `read_only`
+    follower replica only needs `refresh` to drop what it derived from them.
+    """
+
+    def __init__(self, conn, chat_id, read_only=False):
+        self.conn = conn
+        self.chat_id = chat_id
+        self.read_only = read_only
+        self._data_version = None
+        self.lock = LockTable()
+        self.version = 0
+        self._lookup = None
+        # Set when another connection committed since the lookup index was last brought up to date
+        self._lookup_stale = False
+        self.history = HistoryLog(conn, chat_id)
+
+    def load(self):
+        # Rows are read on demand, there is nothing to load up front.
+        self.version += 1
+
+    def refresh(self):
+        # data_version changes whenever another connection commits to the database.
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self.version += 1
+            self._lookup_stale = True
+
+    # --- Reads ---
+
+    @property
+    def lookup(self):
+        # Built from one scan of the names on first use, then kept up to date by add_user/remove_user,
+        # or by one more scan after other connections wrote to the ledger.
+        if self._lookup is None:
+            self._lookup = NameIndex(self.names())
+            self._lookup.build_in_background()
+        elif self._lookup_stale:
+            self._lookup.sync(self.names())
+        self._lookup_stale = False
+        return self._lookup
+
+    def _get_cents(self, name):
+        row = self.conn.execute(
+            "SELECT cents FROM balances WHERE chat_id = ? AND name = ?", (self.chat_id, name)
+        ).fetchone()
+        return row[0] if row else None
+
+    @metrics.timed("storage_op", backend="sqlite", op="get")
+    def get(self, name):
+        cents = self._get_cents(name)
+        return None if cents is None else from_cents(cents)
+
+    @metrics.timed("storage_op", backend="sqlite", op="items")
+    def items(self):
+        rows = self.conn.execute(
+            "SELECT name, cents FROM balances WHERE chat_id = ? ORDER BY name", (self.chat_id,)
+        )
+        return [(name, from_cents(cents)) for name, cents in rows]
+
+    def names(self):
+        rows = self.conn.execute("SELECT name FROM balances WHERE chat_id = ? ORDER BY name", (self.chat_id,))
+        return [name for name, in rows]
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM balances WHERE chat_id = ?", (self.chat_id,)
+        ).fetchone()[0]
+
+    # --- Mutations ---
+
+    @metrics.timed("storage_op", backend="sqlite", op="add_user")
+    def add_user(self, name, balance=0.0, admin=None):
+        balance = from_cents(to_cents(balance))
+        with self._transaction():
+            self.conn.execute(
+                "INSERT INTO balances (chat_id, name, cents) VALUES (?, ?, ?)", (self.chat_id, name, to_cents(balance))
+            )
+            self._record("add_user", name, balance, balance, admin)
+        self.version += 1
+        if self._lookup is not None:
+            self._lookup.add(name)
+        return balance
+
+    @metrics.timed("storage_op", backend="sqlite", op="adjust")
+    def adjust(self, name, delta, admin=None):
+        with self._transaction():
+            current = self._get_cents(name)
+            if current is None:
+                raise KeyError(name)
+            cents = current + to_cents(delta)
+            self.conn.execute(
+                "UPDATE balances SET cents = ? WHERE chat_id = ? AND name = ?", (cents, self.chat_id, name)
+            )
+            balance = from_cents(cents)
+            self._record("adjust", name, delta, balance, admin)
+        self.version += 1
+        return balance
+
+    @metrics.timed("storage_op", backend="sqlite", op="remove_user")
+    def remove_user(self, name, admin=None):
+        with self._transaction():
+            balance = self.get(name)
+            if balance is None:
+                raise KeyError(name)
+            self.conn.execute("DELETE FROM balances WHERE chat_id = ? AND name = ?", (self.chat_id, name))
+            self._record("remove_user", name, -balance, None, admin)
+        self.version += 1
+        if self._lookup is not None:
+            self._lookup.remove(name)
+
+    @metrics.timed("storage_op", backend="sqlite", op="apply_batch")
+    def apply_batch(self, changes, admin=None):
+        """Applies a list of (name, delta) pairs in one transaction; see `BalanceStore.apply_batch`."""
+        with self._transaction():
+            cents = {}
+            for name, _ in changes:
+                if name not in cents:
+                    cents[name] = self._get_cents(name)
+            missing = sorted(name for name, value in cents.items() if value is None)
+            if missing:
+                raise KeyError(missing)
+
+            entries = []
+            for name, delta in changes:
+                cents[name] += to_cents(delta)
+                entries.append({"user": name, "delta": delta, "balance": from_cents(cents[name])})
+                self._record("batch", name, delta, from_cents(cents[name]), admin)
+            self.conn.executemany(
+                "UPDATE balances SET cents = ? WHERE chat_id = ? AND name = ?",
+                [(value, self.chat_id, name) for name, value in cents.items()],
+            )
+        self.version += 1
+        return entries
+
+    @metrics.timed("storage_op", backend="sqlite", op="credit_all")
+    def credit_all(self, delta, admin=None, note=None):
+        """Adds `delta` to every balance with one UPDATE; see `BalanceStore.credit_all`."""
+        # NORMAL sync can lose the last commits on power loss, so this one is synced like the payday mark after it.
+        self.conn.execute("PRAGMA synchronous = FULL")
+        try:
+            with self._transaction():
+                names = self.names()
+                self.conn.execute("UPDATE balances SET cents = cents + ? WHERE chat_id = ?", (to_cents(delta), self.chat_id))
+                self.conn.execute(
+                    "INSERT INTO bulk_operations (chat_id, ts, delta, note, names) VALUES (?, ?, ?, ?, ?)",
+                    (self.chat_id, time.time(), delta, note, json.dumps(names)),
+                )
+                self._record("credit_all", "*", delta, None, admin)
+        finally:
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.version += 1
+        return len(names)
+
+    @metrics.timed("storage_op", backend="sqlite", op="undo_bulk")
+    def undo_bulk(self, admin=None):
+        """Reverts the last `credit_all` for the users that still exist; see `BalanceStore.undo_bulk`."""
+        bulk = self.last_bulk()
+        if bulk is None:
+            return None
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE balances SET cents = cents - ? WHERE chat_id = ? AND name IN (SELECT value FROM json_each(?))",
+                (to_cents(bulk["delta"]), self.chat_id, json.dumps(bulk["names"])),
+            )
+            self.conn.execute("UPDATE bulk_operations SET undone = 1 WHERE id = ?", (bulk["id"],))
+            self._record("undo_bulk", "*", -bulk["delta"], None, admin)
+        self.version += 1
+        return bulk
+
+    def last_bulk(self):
+        row = self.conn.execute(
+            "SELECT id, ts, delta, note, names, undone FROM bulk_operations WHERE chat_id = ? ORDER BY id DESC LIMIT 1",
+            (self.chat_id,),
+        ).fetchone()
+        if row is None or row[5]:
+            return None
+        return {"id": row[0], "ts": row[1], "delta": row[2], "note": row[3], "names": json.loads(row[4])}
+
+    @metrics.timed("storage_op", backend="sqlite", op="import_balances")
+    def import_balances(self, balances, last_bulk=None):
+        """
+        Bulk-loads a `{name: balance}` map, replacing existing rows with the
+        same names, and optionally the last bulk credit (as returned by
+        `BalanceStore.last_bulk`) so it can still be undone.
+        """
+        with self._transaction():
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO balances (chat_id, name, cents) VALUES (?, ?, ?)",
+                [(self.chat_id, name, to_cents(balance)) for name, balance in balances.items()],
+            )
+            if last_bulk is not None:
+                self.conn.execute(
+                    "INSERT INTO bulk_operations (chat_id, ts, delta, note, names) VALUES (?, ?, ?, ?, ?)",
+                    (self.chat_id, last_bulk["ts"], last_bulk["delta"], last_bulk["note"], json.dumps(last_bulk["names"])),
+                )
+        self.version += 1
+        self._lookup_stale = True
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Commits the writes made inside, or rolls them all back and raises StorageError."""
+        try:
+            with self.conn:
+                yield
+        except sqlite3.Error as e:
+            logger.error(f"Error writing balances: {e}")
+            raise StorageError(f"Error writing balances: {e}") from e
+
+    def _record(self, op, name, delta, balance, admin):
+        self.history.insert(op, name, delta, balance, admin)
+
+    async def close(self):
+        # The connection is shared by all groups and closed by the backend.
+        pass
+
+
+class SqliteBackend:
+    """
+    Keeps the ledgers of every group in one SQLite database in WAL mode. The
+    database is only opened (and created) when it is first used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            # WAL lets readers proceed while a write is committing; NORMAL sync survives process crashes,
+            # but not power loss, so the writes that must be durable switch to FULL.
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.executescript(TRANSACTIONS_SCHEMA)
+        return self._conn
+
+    def open(self, chat_id, read_only=False):
+        store = SqliteBalanceStore(self.conn, chat_id, read_only=read_only)
+        store.load()
+        return store
+
+    def chat_ids(self):
+        return {row[0] for row in self.conn.execute("SELECT DISTINCT chat_id FROM balances")}
+
+    def check(self, chat_id):
+        """Reads the database without creating or changing it; returns the number of users of `chat_id`."""
+        if not os.path.exists(self.path):
+            return 0
+        conn = sqlite3.connect(f"file:{quote(os.path.abspath(self.path))}?mode=ro", uri=True)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM balances WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
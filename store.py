@@ -0,0 +1,590 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from array import array
+from metrics import metrics
+from names import NameIndex
+from history import HistoryLog, open_history_db
+
+logger = logging.getLogger(__name__)
+
+# Balances are signed 64-bit integers of cents. Amounts typed by users are
+# capped far below that, so adding many of them up can't overflow either.
+MAX_AMOUNT = 10**12
+
+
+class StorageError(Exception):
+    """A change could not be saved; the ledger is left as it was before it."""
+
+
+def to_cents(amount):
+    return int(round(amount * 100))
+
+
+def from_cents(cents):
+    return cents / 100
+
+
+class LockTable:
+    """
+    A fixed table of asyncio locks sharded by user name, so concurrent handlers
+    touching the same user are serialized without keeping one lock per user.
+    """
+
+    def __init__(self, shards=64):
+        self._locks = [asyncio.Lock() for _ in range(shards)]
+
+    def __call__(self, name):
+        return self._locks[hash(name) % len(self._locks)]
+
+
+class BalanceStore:
+    """
+    JSON implementation of the ledger storage interface shared with
+    `sqlite_store.SqliteBalanceStore`: reads (`get`, `items`, `names`, `in`,
+    `len`), mutations (`add_user`, `adjust`, `remove_user`, `apply_batch`,
+    `credit_all`, `undo_bulk`), `lookup` (a `names.NameIndex`), `history`
+    (a `history.HistoryLog`, or None), `lock`, `version`, `load`, `refresh`
+    and `close`.
+    Amounts are floats at the interface and integer cents inside. Mutations
+    that can't be saved raise `StorageError` and change nothing.
+
+    Keeps the ledger resident in memory and persists it as a snapshot plus an
+    append-only journal. Every mutation costs one small journal append; the
+    snapshot is rewritten (and the journal truncated) only when the journal
+    grows past `compact_threshold` records, or on shutdown.
+
+    Journal records carry the resulting balance as well as the delta, so
+    replaying a journal on top of a snapshot that already includes some of its
+    records is harmless: the last record for each user always wins.
+
+    Mutations themselves never await, so each one is atomic on the event loop.
+    Handlers that check state, await, and then mutate must hold `lock(name)`
+    across the whole sequence.
+
+    With `read_only`, the store never writes its files and instead follows
+    the writes of another process (the leader replica) with `refresh`.
+    """
+
+    def __init__(self, path, journal_path=None, compact_threshold=1000, compact_delay=2.0, history=None, read_only=False):
+        self.path = path
+        self.journal_path = journal_path or os.path.splitext(path)[0] + ".journal"
+        self.compact_threshold = compact_threshold
+        self.compact_delay = compact_delay
+        # Balances are kept as integer cents in a flat array, addressed through a name -> slot index.
+        self._names = []
+        self._index = {}
+        self._cents = array("q")
+        # Case-insensitive and fuzzy name lookups, built on load and then kept up to date.
+        self._lookup = None
+        # The last bulk credit, kept so it can be reverted with `undo_bulk`.
+        self._last_bulk = None
+        self._journal = None
+        self._journal_records = 0
+        self._compact_task = None
+        # Set while a snapshot is being written by a worker thread
+        self._compacting = False
+        self.lock = LockTable()
+        # The journal only covers changes since the last snapshot; the full history is kept here.
+        self.history = history
+        self.read_only = read_only
+        # What `refresh` compares against to notice writes by another process
+        self._snapshot_id = None
+        self._journal_id = None
+        self._journal_offset = 0
+        # Bumped on every change, so readers can cache anything derived from the ledger.
+        self.version = 0
+
+    # --- Loading ---
+
+    @metrics.timed("storage_op", backend="json", op="load")
+    def load(self):
+        self._snapshot_id = None
+        try:
+            if not os.path.exists(self.path):
+                balances = {}
+            else:
+                with open(self.path, "r") as f:
+                    self._snapshot_id = file_id(os.fstat(f.fileno()))
+                    balances = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"Error loading balances: {e}")
+            balances = {}
+        self._names = list(balances)
+        self._index = {name: slot for slot, name in enumerate(self._names)}
+        self._cents = array("q", (to_cents(balance) for balance in balances.values()))
+        if self._lookup is None:
+            self._lookup = NameIndex(self._names)
+            self._lookup.build_in_background()
+        else:
+            # A follower reloading after a compaction: most names are still the same.
+            self._lookup.sync(self._names)
+        self._last_bulk = None
+
+        # Appends change the journal's mtime but not its inode; a compaction replaces the file.
+        self._journal_id = os.stat(self.journal_path).st_ino if os.path.exists(self.journal_path) else None
+        self._journal_offset = 0
+        self._journal_records = self._replay_journal()
+        # The journal is only created by the first append, so a ledger that was merely read leaves no file behind.
+        self.version += 1
+        logger.info(
+            f"Loaded {len(self._names)} balances from {self.path} "
+            f"(+{self._journal_records} journal records)."
+        )
+
+    def _replay_journal(self):
+        """Applies the complete journal records past `_journal_offset`; returns how many there were."""
+        if not os.path.exists(self.journal_path):
+            return 0
+        with open(self.journal_path, "rb") as f:
+            f.seek(self._journal_offset)
+            data = f.read()
+        # Only whole lines: the last one may be torn by a crash, or still being written by the leader.
+        end = data.rfind(b"\n") + 1
+        count = 0
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Ignoring corrupt journal record.")
+                continue
+            self._apply(record)
+            count += 1
+        self._journal_offset += end
+
+        if end < len(data) and not self.read_only:
+            # A crash tore the last record; cut it off so the next append starts on a fresh line.
+            logger.warning("Ignoring torn journal record.")
+            os.truncate(self.journal_path, self._journal_offset)
+        return count
+
+    def refresh(self):
+        """
+        Catches up with the writes of another process: applies the records
+        appended to the journal since the last call, or reloads the ledger if
+        a compaction replaced the snapshot and journal in the meantime.
+        """
+        snapshot_id = file_id(os.stat(self.path)) if os.path.exists(self.path) else None
+        journal_id = os.stat(self.journal_path).st_ino if os.path.exists(self.journal_path) else None
+        if snapshot_id != self._snapshot_id or journal_id != self._journal_id:
+            self.load()
+        else:
+            self._journal_records += self._replay_journal()
+
+    def _apply(self, record):
+        self.version += 1
+        op = record["op"]
+        if op == "batch":
+            for entry in record["entries"]:
+                self._set(entry["user"], to_cents(entry["balance"]))
+        elif op in ("credit_all", "undo_bulk"):
+            for name, balance in zip(record["names"], record["balances"]):
+                self._set(name, to_cents(balance))
+            self._last_bulk = self._rollback_point(record) if op == "credit_all" else None
+        elif op == "rollback_point":
+            self._last_bulk = self._rollback_point(record)
+        elif op == "remove_user":
+            self._remove(record["user"])
+        else:
+            self._set(record["user"], to_cents(record["balance"]))
+
+    def _set(self, name, cents):
+        slot = self._index.get(name)
+        if slot is None:
+            # Appended first: if the amount doesn't fit, nothing else has changed.
+            self._cents.append(cents)
+            self._index[name] = len(self._names)
+            self._names.append(name)
+            if self._lookup is not None:
+                self._lookup.add(name)
+        else:
+            self._cents[slot] = cents
+
+    def _remove(self, name):
+        slot = self._index.pop(name, None)
+        if slot is None:
+            return
+        del self._names[slot]
+        del self._cents[slot]
+        if self._lookup is not None:
+            self._lookup.remove(name)
+        # Removals are rare, so slots are shifted down to keep the ledger in insertion order.
+        for shifted in range(slot, len(self._names)):
+            self._index[self._names[shifted]] = shifted
+
+    # --- Reads ---
+
+    @property
+    def lookup(self):
+        if self._lookup is None:
+            # Only before `load`, while the ledger is still empty
+            self._lookup = NameIndex(self._names)
+        return self._lookup
+
+    def get(self, name):
+        slot = self._index.get(name)
+        return None if slot is None else from_cents(self._cents[slot])
+
+    def items(self):
+        return [(name, from_cents(cents)) for name, cents in zip(self._names, self._cents)]
+
+    def names(self):
+        return list(self._names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._names)
+
+    # --- Mutations ---
+
+    @metrics.timed("storage_op", backend="json", op="add_user")
+    def add_user(self, name, balance=0.0, admin=None):
+        return self._commit("add_user", name, balance, from_cents(to_cents(balance)), admin)
+
+    @metrics.timed("storage_op", backend="json", op="adjust")
+    def adjust(self, name, delta, admin=None):
+        balance = from_cents(self._cents[self._index[name]] + to_cents(delta))
+        return self._commit("adjust", name, delta, balance, admin)
+
+    @metrics.timed("storage_op", backend="json", op="remove_user")
+    def remove_user(self, name, admin=None):
+        balance = self.get(name)
+        if balance is None:
+            raise KeyError(name)
+        self._commit("remove_user", name, -balance, None, admin)
+
+    @metrics.timed("storage_op", backend="json", op="apply_batch")
+    def apply_batch(self, changes, admin=None):
+        """
+        Applies a list of (name, delta) pairs as one journal record, so either
+        every change is persisted or none is. Raises KeyError listing the
+        unknown names without applying anything.
+        """
+        missing = sorted({name for name, _ in changes if name not in self._index})
+        if missing:
+            raise KeyError(missing)
+
+        cents = {}
+        entries = []
+        for name, delta in changes:
+            cents[name] = cents.get(name, self._cents[self._index[name]]) + to_cents(delta)
+            entries.append({"user": name, "delta": delta, "balance": from_cents(cents[name])})
+
+        record = {"ts": time.time(), "op": "batch", "entries": entries, "admin": admin}
+        self._append(record)
+        self._apply(record)
+        return entries
+
+    @metrics.timed("storage_op", backend="json", op="credit_all")
+    def credit_all(self, delta, admin=None, note=None):
+        """
+        Adds `delta` to every balance in one pass over the cents array and
+        records it as a single journal entry, which becomes the rollback point
+        for `undo_bulk`. Returns the number of balances credited.
+        """
+        delta_cents = to_cents(delta)
+        credited = array("q", (cents + delta_cents for cents in self._cents))
+        record = self._bulk_record("credit_all", delta, admin, note, credited)
+        # Synced, as the payday scheduler records the period as applied right after
+        self._append(record, fsync=True)
+        self._cents = credited
+        self.version += 1
+        self._last_bulk = self._rollback_point(record)
+        return len(self._names)
+
+    @metrics.timed("storage_op", backend="json", op="undo_bulk")
+    def undo_bulk(self, admin=None):
+        """
+        Reverts the last `credit_all` for the users that still exist, keeping
+        any change made since. Returns the reverted rollback point, or None if
+        there is nothing to undo.
+        """
+        bulk = self._last_bulk
+        if bulk is None:
+            return None
+        delta_cents = to_cents(bulk["delta"])
+        reverted = array("q", self._cents)
+        for name in bulk["names"]:
+            slot = self._index.get(name)
+            if slot is not None:
+                reverted[slot] -= delta_cents
+        record = self._bulk_record("undo_bulk", -bulk["delta"], admin, bulk["note"], reverted, names=bulk["names"])
+        self._append(record)
+        self._cents = reverted
+        self.version += 1
+        self._last_bulk = None
+        return bulk
+
+    def last_bulk(self):
+        return self._last_bulk
+
+    def _bulk_record(self, op, delta, admin, note, cents, names=None):
+        # The resulting balances (`cents`, not applied yet) are recorded too, so replaying the entry stays idempotent.
+        names = [name for name in (names or self._names) if name in self._index]
+        return {
+            "ts": time.time(),
+            "op": op,
+            "delta": delta,
+            "note": note,
+            "admin": admin,
+            "names": names,
+            "balances": [from_cents(cents[self._index[name]]) for name in names],
+        }
+
+    def _rollback_point(self, record):
+        return {"ts": record["ts"], "delta": record["delta"], "note": record["note"], "names": record["names"]}
+
+    def _commit(self, op, name, delta, balance, admin):
+        record = {
+            "ts": time.time(),
+            "op": op,
+            "user": name,
+            "delta": delta,
+            "balance": balance,
+            "admin": admin,
+        }
+        self._append(record)
+        self._apply(record)
+        return balance
+
+    # --- Persistence ---
+
+    @metrics.timed("storage_op", backend="json", op="journal_append")
+    def _append(self, record, fsync=False):
+        """
+        Writes `record` to the journal. Mutations append before they change
+        the ledger in memory, so when this raises StorageError nothing changed.
+        """
+        size = None
+        try:
+            if self._journal is None:
+                self._journal = open(self.journal_path, "a")
+            size = self._journal.tell()
+            self._journal.write(json.dumps(record) + "\n")
+            self._journal.flush()
+            if fsync:
+                os.fsync(self._journal.fileno())
+        except OSError as e:
+            logger.error(f"Error appending to journal: {e}")
+            self._discard_journal(size)
+            raise StorageError(f"Error appending to journal: {e}") from e
+        self._journal_records += 1
+        if self.history is not None and record["op"] != "rollback_point":
+            self.history.append(record)
+        if self._journal_records >= self.compact_threshold:
+            self._schedule_compaction()
+
+    def _discard_journal(self, size):
+        """Closes the journal after a failed append and cuts off what was written of the record, if anything."""
+        if self._journal is not None:
+            try:
+                self._journal.close()
+            except OSError:
+                # Closing flushes the rest of the record, which fails again.
+                pass
+            self._journal = None
+        if size is not None:
+            try:
+                os.truncate(self.journal_path, size)
+            except OSError as e:
+                # Left for the next load, which ignores a torn last record.
+                logger.error(f"Error truncating journal: {e}")
+
+    def _schedule_compaction(self):
+        if self._compact_task is not None and not self._compact_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (e.g. scripts): compact immediately.
+            self.compact()
+            return
+        self._compact_task = loop.create_task(self._delayed_compaction())
+
+    async def _delayed_compaction(self):
+        await asyncio.sleep(self.compact_delay)
+        if not self.read_only:
+            await self._compact_in_background()
+
+    @metrics.timed("storage_op", backend="json", op="compact")
+    async def _compact_in_background(self):
+        """
+        Like `compact`, but the snapshot is serialized and written by a worker
+        thread, so the event loop keeps serving (and journaling) mutations.
+        """
+        offset, snapshot = self._compaction_mark()
+        self._compacting = True
+        try:
+            head = await asyncio.to_thread(self._write_snapshot, *snapshot)
+        finally:
+            self._compacting = False
+        # A replica demoted meanwhile must leave the journal to the new leader.
+        return head is not None and not self.read_only and self._replace_journal(offset, head)
+
+    @metrics.timed("storage_op", backend="json", op="compact")
+    def compact(self, fsync=True):
+        """Writes a snapshot of the ledger and truncates the journal."""
+        offset, snapshot = self._compaction_mark()
+        head = self._write_snapshot(*snapshot, fsync=fsync)
+        return head is not None and self._replace_journal(offset, head)
+
+    def _compaction_mark(self):
+        """Where the journal stands, and copies of the ledger and rollback point at that point."""
+        offset = self._journal.tell() if self._journal is not None else 0
+        return offset, (list(self._names), array("q", self._cents), self._last_bulk)
+
+    def _write_snapshot(self, names, cents, last_bulk, fsync=True):
+        """
+        Writes the snapshot of a copied ledger; returns the start of the next
+        journal, or None if the snapshot could not be written. Touches no
+        state of the store, so it can run in a worker thread.
+        """
+        if not write_json_atomic(self.path, {name: from_cents(c) for name, c in zip(names, cents)}, fsync=fsync):
+            return None
+        # The snapshot holds balances only, so the rollback point is carried over into the new journal.
+        if last_bulk is None:
+            return b""
+        return json.dumps({"op": "rollback_point", **last_bulk}).encode() + b"\n"
+
+    def _replace_journal(self, offset, head):
+        """
+        Swaps the journal for a new one holding `head` and whatever was
+        appended past `offset` while the snapshot was written. Until then the
+        old journal stays, and replaying it over the new snapshot is harmless.
+        """
+        tail = b""
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+        # A new file rather than a truncated one, so followers can tell the journals apart.
+        tmp_path = f"{self.journal_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(head + tail)
+            os.replace(tmp_path, self.journal_path)
+        except OSError as e:
+            logger.error(f"Error replacing journal: {e}")
+            return False
+
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, "a")
+        self._journal_records = tail.count(b"\n")
+        return True
+
+    async def close(self):
+        """Cancels the pending compaction and writes a final snapshot durably."""
+        if self._compact_task is not None and not self._compact_task.done():
+            if self._compacting:
+                # Cancelling wouldn't stop the thread, which could then race the final snapshot.
+                await self._compact_task
+            else:
+                self._compact_task.cancel()
+        if self._journal_records and not self.read_only:
+            self.compact(fsync=True)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+class JsonBackend:
+    """
+    Opens one BalanceStore per group. The default group keeps using the
+    original balances file, every other group gets `<directory>/<chat_id>.json`.
+    The transaction history of every group goes to the SQLite database at
+    `history_path`, if given.
+    """
+
+    def __init__(self, default_chat_id, default_path, directory="ledgers", history_path=None):
+        self.default_chat_id = default_chat_id
+        self.default_path = default_path
+        self.directory = directory
+        self.history_path = history_path
+        self._history_conn = None
+
+    def path_for(self, chat_id):
+        if chat_id == self.default_chat_id:
+            return self.default_path
+        return os.path.join(self.directory, f"{chat_id}.json")
+
+    def open(self, chat_id, read_only=False):
+        path = self.path_for(chat_id)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        history = None
+        if self.history_path:
+            if self._history_conn is None:
+                self._history_conn = open_history_db(self.history_path)
+            history = HistoryLog(self._history_conn, chat_id)
+        store = BalanceStore(path, history=history, read_only=read_only)
+        store.load()
+        return store
+
+    def chat_ids(self):
+        """Every group that has a ledger on disk."""
+        ids = {self.default_chat_id}
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                stem, ext = os.path.splitext(filename)
+                # Empty journals were left behind by groups that only ever read their ledger.
+                if ext == ".json" or (ext == ".journal" and os.path.getsize(os.path.join(self.directory, filename))):
+                    try:
+                        ids.add(int(stem))
+                    except ValueError:
+                        pass
+        return ids
+
+    def check(self, chat_id):
+        """Reads the ledger of `chat_id` without opening it for writing; returns its number of users."""
+        path = self.path_for(chat_id)
+        if not os.path.exists(path):
+            return 0
+        with open(path, "r") as f:
+            balances = json.load(f)
+        if not isinstance(balances, dict):
+            raise ValueError(f"{path} must hold a map of names to balances.")
+        return len(balances)
+
+    def close(self):
+        if self._history_conn is not None:
+            self._history_conn.close()
+            self._history_conn = None
+
+
+def file_id(stat):
+    """Identifies a version of a file; files replaced with os.replace get a new inode."""
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
+def write_json_atomic(path, data, fsync=True):
+    """
+    Writes `data` to a temporary file next to `path` and renames it into place,
+    so readers and crashes only ever see the old or the new file, never a
+    truncated one.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if fsync and hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        return True
+    except IOError as e:
+        logger.error(f"Error saving {path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
@@ -0,0 +1,48 @@
+import os
+import sys
+import asyncio
+import pytest
+
+# The bot's modules live at the top of the repository, not in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import JsonBackend
+from sqlite_store import SqliteBackend
+
+
+class Backends:
+    """Opens the ledger of a group on one storage backend, and reopens it as a restarted bot would."""
+
+    def __init__(self, kind, directory):
+        self.kind = kind
+        self.directory = directory
+        self.backend = None
+        self.stores = []
+
+    def _make(self):
+        if self.kind == "json":
+            return JsonBackend(-100, str(self.directory / "balances.json"), directory=str(self.directory / "ledgers"))
+        return SqliteBackend(str(self.directory / "balances.db"))
+
+    def open(self, chat_id=-100):
+        if self.backend is None:
+            self.backend = self._make()
+        store = self.backend.open(chat_id)
+        self.stores.append(store)
+        return store
+
+    def restart(self):
+        """Closes every open store and the backend, as on shutdown."""
+        for store in self.stores:
+            asyncio.run(store.close())
+        self.stores = []
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backends(request, tmp_path):
+    backends = Backends(request.param, tmp_path)
+    yield backends
+    backends.restart()
@@ -0,0 +1,90 @@
+import time
+import datetime
+from zoneinfo import ZoneInfo
+from scheduler import PaydayScheduler, charges_of, fire_time
+
+ROME = ZoneInfo("Europe/Rome")
+UTC = datetime.timezone.utc
+CHARGE = {"name": "subscription", "amount": 10, "day": 1}
+
+
+def at(*args):
+    return datetime.datetime(*args, tzinfo=UTC)
+
+
+def test_first_check_only_records_the_latest_period(tmp_path):
+    scheduler = PaydayScheduler(str(tmp_path / "schedule.json"), hour=8)
+    assert scheduler.due(-100, CHARGE, UTC, at(2024, 5, 20)) == []
+    # Already counted as applied, so it isn't charged again later the same month
+    assert scheduler.due(-100, CHARGE, UTC, at(2024, 5, 31)) == []
+
+
+def test_due_fires_at_the_payday_hour(tmp_path):
+    scheduler = PaydayScheduler(str(tmp_path / "schedule.json"), hour=8)
+    scheduler.mark(-100, CHARGE, "2024-04")
+    assert scheduler.due(-100, CHARGE, UTC, at(2024, 5, 1, 7, 59)) == []
+    assert scheduler.due(-100, CHARGE, UTC, at(2024, 5, 1, 8)) == ["2024-05"]
+
+    scheduler.mark(-100, CHARGE, "2024-05")
+    assert scheduler.due(-100, CHARGE, UTC, at(2024, 5, 1, 9)) == []
+
+
+def test_missed_periods_are_caught_up_in_order(tmp_path):
+    scheduler = PaydayScheduler(str(tmp_path / "schedule.json"), hour=8)
+    scheduler.mark(-100, CHARGE, "2023-11")
+    assert scheduler.due(-100, CHARGE, UTC, at(2024, 2, 15)) == ["2023-12", "2024-01", "2024-02"]
+
+
+def test_applied_periods_survive_a_restart(tmp_path):
+    path = str(tmp_path / "schedule.json")
+    PaydayScheduler(path).mark(-100, CHARGE, "2024-05")
+
+    scheduler = PaydayScheduler(path)
+    scheduler.load()
+    assert scheduler.due(-100, CHARGE, UTC, at(2024, 5, 28)) == []
+    assert scheduler.due(-100, CHARGE, UTC, at(2024, 6, 2)) == ["2024-06"]
+
+
+def test_charges_are_scheduled_separately(tmp_path):
+    settings = {"import_amount": 10, "payday_day": 1, "charges": [{"name": "rent", "amount": 5, "day": 15}]}
+    subscription, rent = charges_of(settings)
+    scheduler = PaydayScheduler(str(tmp_path / "schedule.json"), hour=8)
+    scheduler.mark(-100, subscription, "2024-04")
+    scheduler.mark(-100, rent, "2024-04")
+
+    now = at(2024, 5, 10)
+    assert scheduler.due(-100, subscription, UTC, now) == ["2024-05"]
+    assert scheduler.due(-100, rent, UTC, now) == []
+    assert scheduler.next_fire(rent, UTC, now) == at(2024, 5, 15, 8)
+
+
+def test_days_past_the_end_of_the_month_fire_on_its_last_day(tmp_path):
+    charge = dict(CHARGE, day=31)
+    scheduler = PaydayScheduler(str(tmp_path / "schedule.json"), hour=8)
+    scheduler.mark(-100, charge, "2024-01")
+    assert scheduler.due(-100, charge, UTC, at(2024, 2, 29, 7)) == []
+    assert scheduler.due(-100, charge, UTC, at(2024, 2, 29, 8)) == ["2024-02"]
+    assert scheduler.next_fire(charge, UTC, at(2024, 2, 29, 8)) == at(2024, 3, 31, 8)
+
+
+def test_fire_times_follow_the_groups_timezone(tmp_path):
+    # Rome is UTC+1 in winter and UTC+2 in summer.
+    assert fire_time(2024, 3, 1, 8, ROME) == at(2024, 3, 1, 7)
+    assert fire_time(2024, 4, 1, 8, ROME) == at(2024, 4, 1, 6)
+
+    scheduler = PaydayScheduler(str(tmp_path / "schedule.json"), hour=8)
+    scheduler.mark(-100, CHARGE, "2024-03")
+    assert scheduler.due(-100, CHARGE, ROME, at(2024, 4, 1, 5, 59)) == []
+    assert scheduler.due(-100, CHARGE, ROME, at(2024, 4, 1, 6)) == ["2024-04"]
+
+
+def test_local_fire_times_follow_dst(monkeypatch):
+    # Without a TIMEZONE, the server's local time, with the offset in effect on that day
+    monkeypatch.setenv("TZ", "Europe/Rome")
+    time.tzset()
+    try:
+        assert fire_time(2024, 3, 1, 8, None) == at(2024, 3, 1, 7)
+        assert fire_time(2024, 4, 1, 8, None) == at(2024, 4, 1, 6)
+    finally:
+        monkeypatch.undo()
+        time.tzset()
@@ -0,0 +1,57 @@
+from settle import plan_transfers, transfer_changes
+
+
+def settled(balances, transfers):
+    """The balances after applying `transfers` the way /settle apply does."""
+    result = dict(balances)
+    for name, delta in transfer_changes(transfers):
+        result[name] = round(result[name] + delta, 2)
+    return result
+
+
+def test_nothing_to_settle():
+    assert plan_transfers([]) == ([], 0)
+    assert plan_transfers([("Alice", 0.0), ("Bob", 0.0)]) == ([], 0)
+
+
+def test_debtors_pay_creditors():
+    transfers, remainder = plan_transfers([("Alice", 30.0), ("Bob", -10.0), ("Carol", -20.0)])
+    assert transfers == [("Carol", "Alice", 20.0), ("Bob", "Alice", 10.0)]
+    assert remainder == 0
+
+
+def test_equal_amounts_are_paired_first():
+    balances = [("Alice", 7.0), ("Bob", 5.0), ("Carol", -5.0), ("Dave", -7.0)]
+    transfers, _ = plan_transfers(balances)
+    assert sorted(transfers) == [("Carol", "Bob", 5.0), ("Dave", "Alice", 7.0)]
+
+
+def test_plan_zeroes_every_balance_in_at_most_n_minus_one_transfers():
+    balances = [("Alice", 12.34), ("Bob", -0.01), ("Carol", -7.33), ("Dave", 3.0), ("Erin", -8.0)]
+    transfers, remainder = plan_transfers(balances)
+    assert remainder == 0
+    assert len(transfers) <= len(balances) - 1
+    assert all(amount > 0 for _, _, amount in transfers)
+    assert set(settled(balances, transfers).values()) == {0.0}
+
+
+def test_remainder_when_balances_dont_add_up():
+    balances = [("Alice", 10.0), ("Bob", -4.0)]
+    transfers, remainder = plan_transfers(balances)
+    assert transfers == [("Bob", "Alice", 4.0)]
+    assert remainder == 6.0
+    assert settled(balances, transfers) == {"Alice": 6.0, "Bob": 0.0}
+
+    transfers, remainder = plan_transfers([("Alice", 4.0), ("Bob", -10.0)])
+    assert transfers == [("Bob", "Alice", 4.0)]
+    assert remainder == -6.0
+
+
+def test_plan_applied_with_apply_batch(backends):
+    store = backends.open()
+    for name, balance in [("Alice", 25.5), ("Bob", -10.25), ("Carol", -15.25)]:
+        store.add_user(name, balance)
+
+    transfers, _ = plan_transfers(store.items())
+    store.apply_batch(transfer_changes(transfers))
+    assert sorted(store.items()) == [("Alice", 0.0), ("Bob", 0.0), ("Carol", 0.0)]
@@ -0,0 +1,250 @@
+import os
+import json
+import errno
+import asyncio
+import pytest
+from store import BalanceStore, JsonBackend, StorageError
+
+
+class FullDisk:
+    """A journal file whose writes fail, as on a full disk; part of the record gets written first."""
+
+    def __init__(self, path):
+        self._file = open(path, "a")
+
+    def tell(self):
+        return self._file.tell()
+
+    def write(self, data):
+        self._file.write(data[:10])
+        self._file.flush()
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    def close(self):
+        self._file.close()
+
+
+def json_store(tmp_path, **kwargs):
+    store = BalanceStore(str(tmp_path / "balances.json"), **kwargs)
+    store.load()
+    return store
+
+
+# --- Both backends ---
+
+def test_mutations_survive_a_restart(backends):
+    store = backends.open()
+    store.add_user("Bob", 10)
+    store.add_user("Alice")
+    store.adjust("Bob", -2.5)
+    store.apply_batch([("Alice", 4), ("Bob", -4)])
+    store.remove_user("Alice")
+    backends.restart()
+
+    assert backends.open().items() == [("Bob", 3.5)]
+
+
+def test_credit_all_and_undo_bulk(backends):
+    store = backends.open()
+    store.add_user("Alice", 1)
+    store.add_user("Bob", 2)
+
+    assert store.credit_all(3.5, note="subscription 2024-05") == 2
+    assert sorted(store.items()) == [("Alice", 4.5), ("Bob", 5.5)]
+    assert store.last_bulk()["note"] == "subscription 2024-05"
+
+    # Changes made after the credit are kept, and users added since are left alone.
+    store.adjust("Alice", 10)
+    store.add_user("Carol", 7)
+    bulk = store.undo_bulk()
+    assert bulk["delta"] == 3.5
+    assert sorted(store.items()) == [("Alice", 11.0), ("Bob", 2.0), ("Carol", 7.0)]
+    assert store.last_bulk() is None
+    assert store.undo_bulk() is None
+
+
+def test_undo_bulk_skips_removed_users(backends):
+    store = backends.open()
+    store.add_user("Alice", 1)
+    store.add_user("Bob", 2)
+    store.credit_all(1)
+    store.remove_user("Bob")
+
+    store.undo_bulk()
+    assert store.items() == [("Alice", 1.0)]
+
+
+def test_rollback_point_survives_a_restart(backends):
+    store = backends.open()
+    store.add_user("Bob", 1)
+    store.credit_all(2, note="subscription 2024-05")
+    backends.restart()
+
+    store = backends.open()
+    assert store.last_bulk()["note"] == "subscription 2024-05"
+    store.undo_bulk()
+    assert store.items() == [("Bob", 1.0)]
+    backends.restart()
+
+    assert backends.open().last_bulk() is None
+
+
+def test_apply_batch_rejects_unknown_users(backends):
+    store = backends.open()
+    store.add_user("Bob", 1)
+
+    with pytest.raises(KeyError) as e:
+        store.apply_batch([("Bob", 5), ("Nobody", 1), ("Ghost", 1)])
+    assert e.value.args[0] == ["Ghost", "Nobody"]
+    assert store.items() == [("Bob", 1.0)]
+
+
+def test_ledgers_are_kept_per_group(backends):
+    backends.open(-100).add_user("Bob", 1)
+    backends.open(-200).add_user("Bob", 2)
+    backends.restart()
+
+    assert backends.open(-100).get("Bob") == 1.0
+    assert backends.open(-200).get("Bob") == 2.0
+    assert backends.backend.chat_ids() >= {-100, -200}
+
+
+# --- JSON journal ---
+
+def test_journal_is_replayed_without_a_snapshot(tmp_path):
+    store = json_store(tmp_path)
+    store.add_user("Bob", 1)
+    store.adjust("Bob", 2)
+    store.credit_all(1, note="payday")
+    # No close(): as after a crash, only the journal holds the changes.
+    assert not os.path.exists(tmp_path / "balances.json")
+
+    store = json_store(tmp_path)
+    assert store.items() == [("Bob", 4.0)]
+    assert store.last_bulk()["note"] == "payday"
+
+
+def test_replaying_over_a_newer_snapshot_is_harmless(tmp_path):
+    store = json_store(tmp_path)
+    store.add_user("Bob", 1)
+    store.adjust("Bob", 2)
+    journal = (tmp_path / "balances.journal").read_bytes()
+    store.compact()
+    # As after a crash between writing the snapshot and replacing the journal
+    (tmp_path / "balances.journal").write_bytes(journal)
+
+    assert json_store(tmp_path).items() == [("Bob", 3.0)]
+
+
+def test_torn_journal_record_is_cut_off(tmp_path):
+    store = json_store(tmp_path)
+    store.add_user("Bob", 1)
+    with open(tmp_path / "balances.journal", "a") as f:
+        f.write('{"op": "adjust", "user": "Bob", "del')
+
+    store = json_store(tmp_path)
+    assert store.items() == [("Bob", 1.0)]
+    store.adjust("Bob", 1)
+    assert json_store(tmp_path).items() == [("Bob", 2.0)]
+
+
+def test_compaction_carries_the_rollback_point_over(tmp_path):
+    store = json_store(tmp_path)
+    store.add_user("Bob", 1)
+    store.credit_all(5, note="payday")
+    store.adjust("Bob", 1)
+    assert store.compact()
+
+    records = [json.loads(line) for line in (tmp_path / "balances.journal").read_text().splitlines()]
+    assert [record["op"] for record in records] == ["rollback_point"]
+    with open(tmp_path / "balances.json") as f:
+        assert json.load(f) == {"Bob": 7.0}
+
+    store = json_store(tmp_path)
+    assert store.last_bulk()["note"] == "payday"
+    store.undo_bulk()
+    assert store.items() == [("Bob", 2.0)]
+
+
+def test_compaction_keeps_records_appended_while_writing(tmp_path):
+    store = json_store(tmp_path)
+    store.add_user("Bob", 1)
+    offset, snapshot = store._compaction_mark()
+    # Appended while the worker thread writes the snapshot
+    store.adjust("Bob", 10)
+    store.add_user("Alice", 2)
+    head = store._write_snapshot(*snapshot)
+    assert store._replace_journal(offset, head)
+    assert store._journal_records == 2
+
+    with open(tmp_path / "balances.json") as f:
+        assert json.load(f) == {"Bob": 1.0}
+    assert json_store(tmp_path).items() == [("Bob", 11.0), ("Alice", 2.0)]
+
+
+def test_scheduled_compaction_runs_in_the_background(tmp_path):
+    async def run():
+        store = json_store(tmp_path, compact_threshold=3, compact_delay=0)
+        for amount in range(3):
+            store.add_user(f"user{amount}", amount)
+        await store._compact_task
+        assert store._journal_records == 0
+        await store.close()
+
+    asyncio.run(run())
+    with open(tmp_path / "balances.json") as f:
+        assert json.load(f) == {"user0": 0.0, "user1": 1.0, "user2": 2.0}
+
+
+def test_failed_append_leaves_the_ledger_unchanged(tmp_path):
+    store = json_store(tmp_path)
+    store.add_user("Bob", 1)
+    store.credit_all(1, note="payday")
+    journal = (tmp_path / "balances.journal").read_bytes()
+
+    for mutation in (
+        lambda: store.adjust("Bob", 5),
+        lambda: store.add_user("Alice"),
+        lambda: store.remove_user("Bob"),
+        lambda: store.apply_batch([("Bob", 1)]),
+        lambda: store.credit_all(1),
+        lambda: store.undo_bulk(),
+    ):
+        if store._journal is not None:
+            store._journal.close()
+        store._journal = FullDisk(tmp_path / "balances.journal")
+        with pytest.raises(StorageError):
+            mutation()
+        assert store.items() == [("Bob", 2.0)]
+        assert store.last_bulk()["note"] == "payday"
+
+    assert (tmp_path / "balances.journal").read_bytes() == journal
+    store.adjust("Bob", 1)
+    assert json_store(tmp_path).items() == [("Bob", 3.0)]
+
+
+def test_reading_a_ledger_creates_no_files(tmp_path):
+    backend = JsonBackend(-100, str(tmp_path / "balances.json"), directory=str(tmp_path / "ledgers"))
+    store = backend.open(-555)
+    assert store.get("Bob") is None
+    asyncio.run(store.close())
+
+    assert os.listdir(tmp_path / "ledgers") == []
+    assert backend.chat_ids() == {-100}
+
+
+def test_follower_sees_the_leaders_writes(tmp_path):
+    leader = json_store(tmp_path)
+    leader.add_user("Bob", 1)
+    follower = json_store(tmp_path, read_only=True)
+
+    leader.adjust("Bob", 1)
+    follower.refresh()
+    assert follower.get("Bob") == 2.0
+
+    leader.add_user("Alice", 5)
+    leader.compact()
+    leader.adjust("Alice", 1)
+    follower.refresh()
+    assert follower.items() == [("Bob", 2.0), ("Alice", 6.0)]
+    assert follower.lookup.resolve("alice") == "Alice"
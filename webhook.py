@@ -0,0 +1,84 @@
+import hmac
+import signal
+import asyncio
+import logging
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Telegram sends the secret given to set_webhook in this header with every update
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def make_web_app(application, path, secret_token=None):
+    """
+    Builds the aiohttp app that receives updates on `path` and hands them to
+    the bot's update queue. Requests without the right secret are rejected.
+    """
+    async def handle_update(request):
+        if secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            if not isinstance(data, dict):
+                raise ValueError("an update must be a JSON object")
+            update = Update.de_json(data, application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.warning(f"Rejected a malformed update: {e}")
+            return web.Response(status=400)
+
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def health(request):
+        return web.Response(text="ok")
+
+    web_app = web.Application()
+    web_app.router.add_post(path, handle_update)
+    web_app.router.add_get("/health", health)
+    return web_app
+
+
+async def run_webhook(application, listen, port, path, secret_token=None, webhook_url=None, allowed_updates=None):
+    """
+    Serves updates over HTTP until SIGINT/SIGTERM, following the same lifecycle
+    as `Application.run_polling`: post_init runs after initialize, and on
+    shutdown the server stops accepting updates before the application is
+    stopped and post_shutdown flushes pending balance writes.
+
+    The webhook is only registered with Telegram when `webhook_url` is given,
+    so the server can also run behind a proxy that registers it, or be driven
+    locally by POSTing Update JSON to it.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(make_web_app(application, path, secret_token))
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+        await runner.setup()
+        await web.TCPSite(runner, listen, port).start()
+        logger.info(f"Listening for updates on http://{listen}:{port}{path}")
+
+        if webhook_url:
+            await application.bot.set_webhook(webhook_url, secret_token=secret_token, allowed_updates=allowed_updates)
+            logger.info(f"Webhook registered at {webhook_url}")
+
+        await stop.wait()
+    finally:
+        logger.info("Shutting down webhook server...")
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)